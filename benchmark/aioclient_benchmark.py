@@ -0,0 +1,115 @@
+"""
+AsyncClient benchmark
+
+Drive N cars with AsyncClient from one event loop against a synthetic
+telemetry server (run in another process) and report the achieved
+telemetry rate per car and the CPU used by the client process.
+Each car decodes the image of every telemetry (as the brain input would be)
+and answers with a control message, no inference is done.
+
+Usage : python benchmark/aioclient_benchmark.py [duration] [rate] [N1 N2 ...]
+"""
+
+import os
+import io
+import sys
+import json
+import base64
+import asyncio
+import numpy as np
+from multiprocessing import Process, Queue
+from time import time, process_time
+
+# For avoid warning in Visual Code
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from PIL import Image
+from core.aioclient import AsyncClient
+
+HOST = "127.0.0.1"
+IMAGE_SHAPE = (120, 160, 3)
+
+def make_jpeg():
+    """
+    JPEG of random pixels, about the size of a simulator frame
+    """
+    img = np.random.default_rng(0).integers(0, 256, IMAGE_SHAPE, dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(img).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def make_telemetry(i, image):
+    return (json.dumps({"msg_type" : "telemetry", "steering_angle" : 0.0, "throttle" : 0.3, "speed" : 1.5, "image" : image,
+                        "hit" : "none", "time" : i / 20, "accel_x" : 0.0, "accel_y" : 0.0, "accel_z" : 0.0,
+                        "gyro_x" : 0.0, "gyro_y" : 0.0, "gyro_z" : 0.0, "activeNode" : i % 120}) + "\n").encode("utf-8")
+
+def synthetic_server(port_queue, rate):
+    """
+    Send telemetry at rate Hz to each connection and count received controls
+    """
+    image = base64.b64encode(make_jpeg()).decode("utf-8")
+    frames = [make_telemetry(i, image) for i in range(100)]
+
+    async def handle(reader, writer):
+        async def read_controls():
+            while await reader.read(65536):
+                pass
+        read_task = asyncio.ensure_future(read_controls())
+        i = 0
+        try:
+            while not read_task.done():
+                writer.write(frames[i % len(frames)])
+                await writer.drain()
+                i += 1
+                await asyncio.sleep(1 / rate)
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, HOST, 0)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+async def run_cars(port, nbr_car, duration):
+    """
+    :return: (telemetry received per car per second, cpu ratio of the client process)
+    """
+    counter = {"telemetry" : 0}
+    def drive(client):
+        counter["telemetry"] += 1
+        _, img, t, _ = client.get_telemetry_frame()
+        client.send_car_control(t.activeNode / 120, 0.3, 0)
+
+    clients = [AsyncClient(HOST, port, on_telemetry = drive) for _ in range(nbr_car)]
+    await asyncio.gather(*[c.start() for c in clients])
+    # warm up
+    await asyncio.sleep(1)
+    counter["telemetry"] = 0
+    t0, c0 = time(), process_time()
+    await asyncio.sleep(duration)
+    delta, cpu = time() - t0, process_time() - c0
+    received = counter["telemetry"]
+    await asyncio.gather(*[c.stop_async() for c in clients])
+    return received / delta / nbr_car, cpu / delta
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    nbr_cars = [int(n) for n in sys.argv[3:]] or [1, 8, 32, 64, 128]
+
+    port_queue = Queue()
+    server = Process(target=synthetic_server, args=(port_queue, rate), daemon=True)
+    server.start()
+    port = port_queue.get()
+
+    print("[INFO] telemetry rate :", rate, "Hz / duration :", duration, "s")
+    for nbr_car in nbr_cars:
+        hz, cpu = asyncio.run(run_cars(port, nbr_car, duration))
+        print("[INFO] cars =", nbr_car, "/ Hz per car =", round(hz, 1), "/ client CPU =", str(round(cpu * 100, 1)) + "%")
+    server.terminate()
@@ -0,0 +1,123 @@
+"""
+Batched inference benchmark
+
+Drive N cars (Client + Controller each) against a local ReplayServer,
+first with one predict per frame on a shared brain, then through a
+BatchInferenceServer for each window, and report the achieved control rate
+per car, the control latency and the batch sizes.
+
+Usage :
+    python benchmark/batch_benchmark.py --cars 4 --rate 20 --windows 0 0.002 0.005 0.01
+    python benchmark/batch_benchmark.py --cars 4 --model path/to/model
+Without --model, a brain with a fixed cost by call (--call-ms, per-call overhead
+of Keras) plus a cost by frame (--frame-ms) is used, both releasing the GIL.
+"""
+
+import argparse
+import numpy as np
+from threading import Lock
+from time import sleep
+
+from common import make_data_path
+
+from core.client import Client
+from core.replay_server import ReplayServer
+from controller import Controller
+from manager import DataManager
+from brain.batch_server import BatchInferenceServer
+from hardware.scripted import ScriptedController
+from utils.stats import DrivingStats
+
+class CostBrain:
+    """
+    Brain without model, one call costs call_ms + frame_ms by frame
+    Only one call at a time (like one model on one device)
+    """
+    def __init__(self, call_ms = 5, frame_ms = 0.5):
+        self.call_time = call_ms / 1000
+        self.frame_time = frame_ms / 1000
+        self.lock = Lock()
+
+    def predict(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
+        return self.predict_batch([img], [(speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)])[0]
+
+    def predict_batch(self, imgs, speed_accel_gyro):
+        with self.lock:
+            sleep(self.call_time + self.frame_time * len(imgs))
+        return [(0.0, 0.3, 0)] * len(imgs)
+
+def run(args, brain, window):
+    """
+    :param window: window of the BatchInferenceServer (None : brain.predict by each car)
+    :return: (achieved Hz by car, control latency p50 in ms, batch stats)
+    """
+    server = ReplayServer(port = 0, eslr_path = args.eslr, rate = args.rate, max_frames = args.max_frames)
+    server.start()
+    batch_server = None
+    if window is not None:
+        batch_server = BatchInferenceServer(brain, window = window, max_batch = args.cars)
+    data_manager = DataManager(make_data_path())
+    data_manager.next()
+    cars = []
+    for _ in range(args.cars):
+        client = Client("127.0.0.1", server.port, convert_json2img = True, event_driven = True, skip_unchanged_control = False)
+        controller = Controller(client = client, hardware = ScriptedController([{"frames": float("inf"), "start_car": True}]),
+                                data_manager = data_manager, brain = brain if batch_server is None else batch_server,
+                                autopilote = True, headless = True, stats = DrivingStats(verbose = False))
+        cars.append((client, controller))
+    sleep(args.warmup)
+    for session in server.sessions:
+        session.sent_times.clear()
+        session.received.clear()
+    if batch_server is not None:
+        batch_server.batch_sizes.clear()
+        batch_server.waits.clear()
+    sleep(args.duration)
+
+    answered, latencies = 0, []
+    for session in server.sessions:
+        session_answered, session_latencies = session.control_stats()
+        answered += session_answered
+        latencies += session_latencies
+    batch_stats = batch_server.stats() if batch_server is not None else None
+
+    for client, controller in cars:
+        controller.running = False
+    for client, controller in cars:
+        controller.controller_thread.join()
+        controller.stats.stop()
+        client.stop()
+    if batch_server is not None:
+        batch_server.stop()
+    data_manager.close()
+    server.stop()
+    p50 = float(np.percentile(np.array(latencies) * 1000, 50)) if len(latencies) > 0 else float("nan")
+    return answered / args.duration / args.cars, p50, batch_stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched inference benchmark")
+    parser.add_argument("--cars", type=int, default=4, help="number of cars")
+    parser.add_argument("--eslr", default=None, help="recording to replay (default : synthetic telemetry)")
+    parser.add_argument("--model", default=None, help="model dir (model.code + weights.data)")
+    parser.add_argument("--call-ms", type=float, default=5, help="cost of a call of the brain without model (ms)")
+    parser.add_argument("--frame-ms", type=float, default=0.5, help="cost by frame of the brain without model (ms)")
+    parser.add_argument("--rate", type=float, default=50, help="telemetry rate by car (Hz)")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 0.002, 0.005, 0.01], help="windows of the batch server (s)")
+    parser.add_argument("--duration", type=float, default=10, help="measure duration (s)")
+    parser.add_argument("--warmup", type=float, default=3, help="warm up duration (s)")
+    parser.add_argument("--max-frames", type=int, default=2000, help="maximum number of frames loaded from the recording")
+    args = parser.parse_args()
+
+    if args.model is not None:
+        from brain.brain import Brain
+        brain = Brain(DataManager(make_data_path()), model_path = args.model)
+    else:
+        brain = CostBrain(args.call_ms, args.frame_ms)
+
+    print("---------------------------")
+    hz, p50, _ = run(args, brain, None)
+    print("[INFO] no batch        : achieved Hz by car =", round(hz, 2), "/ target Hz =", args.rate, "/ control latency p50 =", round(p50, 2), "ms")
+    for window in args.windows:
+        hz, p50, batch_stats = run(args, brain, window)
+        print("[INFO] window", str(round(window * 1000, 1)).rjust(5), "ms : achieved Hz by car =", round(hz, 2), "/ target Hz =", args.rate,
+              "/ control latency p50 =", round(p50, 2), "ms / mean batch =", round(batch_stats.get("mean_size", 0), 2), "/ sizes =", batch_stats.get("sizes"))
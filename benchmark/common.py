@@ -0,0 +1,25 @@
+"""
+Shared setup of the benchmark scripts
+
+Imported first by each script (python benchmark/<script>.py), it makes the
+packages of the repository importable.
+"""
+
+import os
+import sys
+import tempfile
+
+# For avoid warning in Visual Code
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+def make_data_path():
+    """
+    Create a temporary data dir (model, log and sample dirs) for a DataManager
+    :return: path of the data dir
+    """
+    data_path = tempfile.mkdtemp(prefix="lopilo-bench-")
+    for data_type in ["model", "log", "sample"]:
+        os.mkdir(os.path.join(data_path, data_type))
+    return data_path
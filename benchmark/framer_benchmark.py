@@ -0,0 +1,84 @@
+"""
+Framer benchmark
+
+Compare the legacy str buffer (find/rfind/split) with MessageFramer
+on a synthetic telemetry stream cut in socket-sized chunks.
+"""
+
+import os
+import sys
+import json
+import base64
+import random
+from time import perf_counter
+
+# For avoid warning in Visual Code
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from core.framer import MessageFramer
+
+NBR_MSG = 2000
+CHUNK_SIZE = 1024 * 256
+IMAGE_SIZE = 15000
+
+def make_stream(nbr_msg = NBR_MSG, image_size = IMAGE_SIZE):
+    """
+    Build a fake telemetry stream
+    """
+    image = base64.b64encode(os.urandom(image_size)).decode("utf-8")
+    msgs = []
+    for i in range(nbr_msg):
+        msgs.append(json.dumps({"msg_type" : "telemetry", "steering_angle" : 0.0, "throttle" : 0.3, "speed" : random.random(), "image" : image, "activeNode" : i % 120}))
+    return ("\n".join(msgs) + "\n").encode("utf-8")
+
+def chunks(stream, chunk_size = CHUNK_SIZE):
+    """
+    Cut the stream like socket.recv does (random size up to chunk_size)
+    """
+    i = 0
+    while i < len(stream):
+        n = random.randint(1, chunk_size)
+        yield stream[i:i + n]
+        i += n
+
+def legacy_framer(stream_chunks):
+    """
+    Framing used by Client.proc_msg before MessageFramer
+    """
+    count = 0
+    localbuffer = ""
+    for data in stream_chunks:
+        localbuffer += data.decode("utf-8")
+        n0 = localbuffer.find("{")
+        n1 = localbuffer.rfind("}")
+        if n1 >= 0 and n0 >= 0 and n0 < n1:
+            msgs = localbuffer[n0:n1+1].split("\n")
+            localbuffer = localbuffer[n1:]
+            for m in msgs:
+                if len(m) <= 2:
+                    continue
+                count += 1
+    return count
+
+def message_framer(stream_chunks):
+    """
+    Framing with MessageFramer
+    """
+    count = 0
+    framer = MessageFramer()
+    for data in stream_chunks:
+        count += len(framer.feed(data))
+    return count
+
+if __name__ == "__main__":
+    random.seed(0)
+    stream = make_stream()
+    stream_chunks = list(chunks(stream))
+    print("[INFO] stream of", len(stream), "bytes in", len(stream_chunks), "chunks")
+    for name, funct in [("legacy", legacy_framer), ("MessageFramer", message_framer)]:
+        t = perf_counter()
+        count = funct(stream_chunks)
+        delta = perf_counter() - t
+        print("[INFO]", name, ":", count, "messages in", round(delta * 1000, 2), "ms /", round(count / delta), "msg/s")
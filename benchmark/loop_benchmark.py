@@ -0,0 +1,81 @@
+"""
+End-to-end loop benchmark
+
+Run Client + Controller + Brain against a local ReplayServer replaying
+an .eslr recording, then report the achieved control rate (frames answered
+by a control message per second) and the control latency measured by the
+server (telemetry sent -> first control received).
+
+Usage :
+    python benchmark/loop_benchmark.py --eslr sample.eslr --model path/to/model --duration 30
+Without --model, a constant brain is used (measures the loop without inference).
+"""
+
+import argparse
+import numpy as np
+from time import sleep
+
+from common import make_data_path
+
+from core.client import Client
+from core.replay_server import ReplayServer
+from controller import Controller
+from manager import DataManager
+from utils.latency import LatencyTracer
+from hardware.scripted import ScriptedController
+
+class ConstantBrain:
+    """
+    Brain without model
+    """
+    def predict(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
+        return (0.0, 0.3, 0)
+
+def report(server, duration):
+    print("---------------------------")
+    for session in server.sessions:
+        answered, latencies = session.control_stats()
+        print("[INFO] client", session.address, ":", len(session.sent_times), "frames sent,", answered, "answered")
+        print("[INFO] achieved Hz =", round(answered / duration, 2), "/ target Hz =", server.rate)
+        if len(latencies) > 0:
+            p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+            print("[INFO] control latency (ms) : p50 =", round(p50, 2), "/ p95 =", round(p95, 2), "/ p99 =", round(p99, 2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end loop benchmark")
+    parser.add_argument("--eslr", default=None, help="recording to replay (default : synthetic telemetry)")
+    parser.add_argument("--model", default=None, help="model dir (model.code + weights.data)")
+    parser.add_argument("--rate", type=float, default=20, help="telemetry rate (Hz)")
+    parser.add_argument("--duration", type=float, default=20, help="measure duration (s)")
+    parser.add_argument("--max-frames", type=int, default=2000, help="maximum number of frames loaded from the recording")
+    args = parser.parse_args()
+
+    server = ReplayServer(port = 0, eslr_path = args.eslr, rate = args.rate, max_frames = args.max_frames)
+    server.start()
+
+    data_manager = DataManager(make_data_path())
+    if args.model is not None:
+        from brain.brain import Brain
+        data_manager.copy_model(args.model)
+        brain = Brain(data_manager)
+    else:
+        brain = ConstantBrain()
+    data_manager.next()
+
+    tracer = LatencyTracer()
+    client = Client("127.0.0.1", server.port, convert_json2img = True, event_driven = True, tracer = tracer, skip_unchanged_control = False)
+    controller = Controller(client = client, hardware = ScriptedController([{"frames": float("inf"), "start_car": True}]), data_manager = data_manager, brain = brain, autopilote = True, tracer = tracer, headless = True)
+
+    # warm up (first inference, tracing, ...)
+    sleep(2)
+    for session in server.sessions:
+        session.sent_times.clear()
+        session.received.clear()
+    sleep(args.duration)
+
+    controller.running = False
+    controller.controller_thread.join()
+    client.stop()
+    report(server, args.duration)
+    tracer.print_summary()
+    server.stop()
@@ -0,0 +1,131 @@
+"""
+Threaded vs multiprocess benchmark
+
+Run the same brain against a local ReplayServer, first with the threaded
+runtime (Client + Controller in one process), then with the multiprocess
+Pipeline (receiver / inference / recorder processes sharing the frames
+through a shared memory ring), and compare the achieved control rate.
+
+Usage :
+    python benchmark/pipeline_benchmark.py --rate 100 --inference-ms 8 --duration 20
+    python benchmark/pipeline_benchmark.py --eslr sample.eslr --model path/to/model
+--inference-ms simulates the python work of a brain holding the GIL (without --model).
+"""
+
+import os
+import argparse
+import functools
+import numpy as np
+from time import sleep, perf_counter
+
+from common import make_data_path
+
+from core.client import Client
+from core.replay_server import ReplayServer
+from core.pipeline import Pipeline
+
+class BusyBrain:
+    """
+    Brain without model, busy during inference_ms (pure python, holds the GIL)
+    """
+    def __init__(self, inference_ms = 0):
+        self.inference_time = inference_ms / 1000
+
+    def predict(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
+        end = perf_counter() + self.inference_time
+        while perf_counter() < end:
+            pass
+        return (0.0, 0.3, 0)
+
+def make_brain(model_path = None, inference_ms = 0):
+    """
+    Build the brain (called in the inference process for the pipeline)
+    """
+    if model_path is None:
+        return BusyBrain(inference_ms)
+    from manager import DataManager
+    from brain.brain import Brain
+    data_manager = DataManager(make_data_path())
+    return Brain(data_manager, model_path = model_path)
+
+def reset_sessions(server):
+    for session in server.sessions:
+        session.sent_times.clear()
+        session.received.clear()
+
+def achieved_hz(server, duration):
+    """
+    :return: (frames answered by a control per second, control latency p50 in ms)
+    """
+    answered, latencies = 0, []
+    for session in server.sessions:
+        session_answered, session_latencies = session.control_stats()
+        answered += session_answered
+        latencies += session_latencies
+    p50 = float(np.percentile(np.array(latencies) * 1000, 50)) if len(latencies) > 0 else float("nan")
+    return answered / duration, p50
+
+def run_threaded(args, brain_factory):
+    from controller import Controller
+    from manager import DataManager
+    from hardware.scripted import ScriptedController
+    from utils.stats import DrivingStats
+
+    server = ReplayServer(port = 0, eslr_path = args.eslr, rate = args.rate, max_frames = args.max_frames)
+    server.start()
+    data_manager = DataManager(make_data_path())
+    data_manager.next()
+    brain = brain_factory()
+    client = Client("127.0.0.1", server.port, convert_json2img = True, event_driven = True, skip_unchanged_control = False)
+    controller = Controller(client = client, hardware = ScriptedController([{"frames": float("inf"), "start_car": True, "rec": args.record}]),
+                            data_manager = data_manager, brain = brain, autopilote = True, headless = True, stats = DrivingStats(verbose = False))
+    # warm up (first inference, tracing, ...)
+    sleep(args.warmup)
+    reset_sessions(server)
+    sleep(args.duration)
+    result = achieved_hz(server, args.duration)
+
+    controller.running = False
+    controller.controller_thread.join()
+    controller.stats.stop()
+    client.stop()
+    data_manager.close()
+    server.stop()
+    return result, {"processed" : controller.processed_frames, "skipped" : controller.skipped_frames}
+
+def run_pipeline(args, brain_factory):
+    server = ReplayServer(port = 0, eslr_path = args.eslr, rate = args.rate, max_frames = args.max_frames)
+    server.start()
+    sample_path = os.path.join(make_data_path(), "sample", "sample.eslr") if args.record else None
+    pipeline = Pipeline("127.0.0.1", server.port, brain_factory, sample_path = sample_path,
+                        client_kwargs = {"skip_unchanged_control" : False})
+    pipeline.start()
+    sleep(args.warmup)
+    reset_sessions(server)
+    sleep(args.duration)
+    result = achieved_hz(server, args.duration)
+    stats = pipeline.stats()
+    pipeline.stop()
+    server.stop()
+    return result, stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Threaded vs multiprocess benchmark")
+    parser.add_argument("--eslr", default=None, help="recording to replay (default : synthetic telemetry)")
+    parser.add_argument("--model", default=None, help="model dir (model.code + weights.data)")
+    parser.add_argument("--inference-ms", type=float, default=5, help="busy time of the brain without model (ms)")
+    parser.add_argument("--rate", type=float, default=100, help="telemetry rate (Hz)")
+    parser.add_argument("--duration", type=float, default=10, help="measure duration (s)")
+    parser.add_argument("--warmup", type=float, default=3, help="warm up duration (s)")
+    parser.add_argument("--max-frames", type=int, default=2000, help="maximum number of frames loaded from the recording")
+    parser.add_argument("--record", action="store_true", help="record the frames while driving")
+    args = parser.parse_args()
+
+    brain_factory = functools.partial(make_brain, args.model, args.inference_ms)
+    results = {}
+    for mode, run in (("threaded", run_threaded), ("multiprocess", run_pipeline)):
+        (hz, p50), counters = run(args, brain_factory)
+        results[mode] = hz
+        print("[INFO]", mode.ljust(12), ": achieved Hz =", round(hz, 2), "/ target Hz =", args.rate, "/ control latency p50 =", round(p50, 2), "ms /", counters)
+    if results["threaded"] > 0:
+        print("[INFO] multiprocess / threaded =", round(results["multiprocess"] / results["threaded"], 2))
@@ -0,0 +1,74 @@
+"""
+Brain.predict micro-benchmark
+
+Per-call latency of Brain.predict for one frame, with model.predict
+(realtime = False) and with the traced forward function (realtime = True),
+on the same model and the same frames.
+
+Usage :
+    python benchmark/predict_benchmark.py --model path/to/model [--calls 200] [--eslr sample.eslr]
+"""
+
+import json
+import argparse
+import numpy as np
+from time import perf_counter
+
+from common import make_data_path
+
+from manager import DataManager
+from brain.brain import Brain
+from core.frame import decode_image
+from core.replay_server import load_eslr_frames, synthetic_frames
+
+def load_inputs(eslr_path, max_frames):
+    """
+    :return: list of (img, speed_accel_gyro) decoded from the telemetry frames
+    """
+    frames = load_eslr_frames(eslr_path, max_frames) if eslr_path is not None else synthetic_frames(max_frames)
+    inputs = []
+    for frame in frames:
+        j = json.loads(frame)
+        speed_accel_gyro = tuple(float(j.get(k, 0)) for k in ("speed", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z"))
+        inputs.append((decode_image(j["image"]), speed_accel_gyro))
+    return inputs
+
+def measure(brain, inputs, calls, warmup = 10):
+    """
+    :return: (latencies in ms, angles)
+    """
+    for i in range(warmup):
+        img, speed_accel_gyro = inputs[i % len(inputs)]
+        brain.predict(img, *speed_accel_gyro)
+    latencies = []
+    angles = []
+    for i in range(calls):
+        img, speed_accel_gyro = inputs[i % len(inputs)]
+        t = perf_counter()
+        angle, throttle, brake = brain.predict(img, *speed_accel_gyro)
+        latencies.append(perf_counter() - t)
+        angles.append(float(angle))
+    return np.array(latencies) * 1000, np.array(angles)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Brain.predict micro-benchmark")
+    parser.add_argument("--model", required=True, help="model dir (model.code + weights.data)")
+    parser.add_argument("--eslr", default=None, help="recording giving the frames (default : synthetic frames)")
+    parser.add_argument("--calls", type=int, default=200, help="number of measured calls")
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.eslr, min(args.calls, 500))
+    data_manager = DataManager(make_data_path())
+    results = {}
+    for realtime in (False, True):
+        name = "realtime" if realtime else "model.predict"
+        t = perf_counter()
+        brain = Brain(data_manager, model_path = args.model, realtime = realtime)
+        load_time = perf_counter() - t
+        latencies, angles = measure(brain, inputs, args.calls)
+        results[name] = (latencies, angles)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print("[INFO]", name.ljust(14), ": load =", round(load_time, 2), "s / p50 =", round(p50, 3), "ms / p95 =", round(p95, 3), "ms / p99 =", round(p99, 3), "ms")
+    speedup = np.median(results["model.predict"][0]) / np.median(results["realtime"][0])
+    max_diff = np.max(np.abs(results["model.predict"][1] - results["realtime"][1]))
+    print("[INFO] speedup (p50) =", round(speedup, 1), "x / max angle difference =", max_diff)
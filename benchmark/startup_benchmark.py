@@ -0,0 +1,79 @@
+"""
+Brain startup benchmark
+
+Time from the launch of a python process to the first prediction, following
+launch.py : the model is copied into a new session dir (DataManager.copy_model)
+of one data dir, then loaded. Without the forward cache (model.code exec + build
++ compile + trace), when the cache entry is written (first launch of a model)
+and when it is loaded (next launches, see brain.cache).
+Each run is a new process, so nothing is kept in memory between the runs.
+
+Usage :
+    python benchmark/startup_benchmark.py --model path/to/model [--runs 3]
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import subprocess
+import numpy as np
+from time import perf_counter
+
+START = perf_counter()
+
+from common import make_data_path
+
+def child(model_path, data_path, cache):
+    """
+    Copy the model into a new session of data_path, load the brain and predict one frame,
+    print the times (seconds) as json
+    """
+    from manager import DataManager
+    from brain.brain import Brain
+    imported = perf_counter()
+    data_manager = DataManager(data_path)
+    data_manager.copy_model(model_path)
+    brain = Brain(data_manager, realtime = True, cache = cache)
+    loaded = perf_counter()
+    img = np.zeros(brain.image_shape, dtype=np.uint8)
+    brain.predict(img, 0, 0, 0, 0, 0, 0, 0)
+    predicted = perf_counter()
+    print(json.dumps({"import" : imported - START, "load" : loaded - imported, "first_predict" : predicted - loaded, "total" : predicted - START}))
+
+def run(model_path, data_path, cache):
+    output = subprocess.run([sys.executable, os.path.realpath(__file__), "--model", model_path, "--data-path", data_path, "--child", "cache" if cache else "no-cache"],
+                            stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True)
+    return json.loads(output.stdout.decode("utf-8").strip().splitlines()[-1])
+
+def print_runs(name, runs):
+    median = {k : float(np.median([r[k] for r in runs])) for k in runs[0]}
+    print("[INFO]", name.ljust(12), ": total =", round(median["total"], 2), "s / import =", round(median["import"], 2), "s / load =", round(median["load"], 2),
+          "s / first predict =", round(median["first_predict"] * 1000, 1), "ms")
+    return median
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Brain startup benchmark")
+    parser.add_argument("--model", required=True, help="model dir (model.code + weights.data)")
+    parser.add_argument("--runs", type=int, default=3, help="number of processes by mode")
+    parser.add_argument("--child", default=None, choices=["cache", "no-cache"], help=argparse.SUPPRESS)
+    parser.add_argument("--data-path", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.model, args.data_path, args.child == "cache")
+        sys.exit(0)
+
+    # one data dir for all the launches, like the data dir of launch.py
+    data_path = make_data_path()
+    cache_dir = os.path.join(data_path, "model", "cache")
+    print("---------------------------")
+    no_cache = print_runs("no cache", [run(args.model, data_path, False) for _ in range(args.runs)])
+    writes = []
+    for _ in range(args.runs):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        writes.append(run(args.model, data_path, True))
+    print_runs("cache write", writes)
+    cached = print_runs("cache load", [run(args.model, data_path, True) for _ in range(args.runs)])
+    print("[INFO] load + first predict :", round(no_cache["load"] + no_cache["first_predict"], 2), "s ->", round(cached["load"] + cached["first_predict"], 2), "s")
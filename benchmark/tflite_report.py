@@ -0,0 +1,92 @@
+"""
+TFLite report
+
+Compare the Keras model (Brain, realtime) and its TFLite exports (float32,
+float16, int8) on the same recording : latency of predict for one frame and
+steering error against the Keras model (and against the user if recorded).
+
+Usage :
+    python benchmark/tflite_report.py --model path/to/model --eslr-dir path/to/sample_dir [--calibration-dir path/to/sample_dir]
+The recording dir contains a label.csv (extracted samples) or .eslr files.
+The int8 quantization is calibrated on --calibration-dir (default : the recording dir).
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from time import perf_counter
+
+from common import make_data_path
+
+from manager import DataManager
+from brain.brain import Brain
+from brain.tflite import TFLiteBrain, load_sample_frames
+
+def run(brain, frames, warmup = 10):
+    """
+    :return: (latencies in ms, predicted angles)
+    """
+    for img, speed_accel_gyro, _ in frames[:warmup]:
+        brain.predict(img, *speed_accel_gyro)
+    latencies = []
+    angles = []
+    for img, speed_accel_gyro, _ in frames:
+        t = perf_counter()
+        angle, throttle, brake = brain.predict(img, *speed_accel_gyro)
+        latencies.append(perf_counter() - t)
+        angles.append(float(angle))
+    return np.array(latencies) * 1000, np.array(angles)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TFLite report")
+    parser.add_argument("--model", required=True, help="model dir (model.code + weights.data)")
+    parser.add_argument("--eslr-dir", required=True, help="recording (label.csv or .eslr files) used for the comparison")
+    parser.add_argument("--calibration-dir", default=None, help="frames calibrating the int8 quantization (default : --eslr-dir)")
+    parser.add_argument("--frames", type=int, default=500, help="number of frames of the recording")
+    parser.add_argument("--num-threads", type=int, default=None, help="threads of the TFLite interpreter")
+    parser.add_argument("--output", default=None, help="json report (default : tflite_report.json in the model dir)")
+    args = parser.parse_args()
+
+    frames = load_sample_frames(args.eslr_dir, args.frames)
+    if len(frames) == 0:
+        raise Exception("No frames in " + args.eslr_dir)
+    user_angles = np.array([u if u is not None else np.nan for _, _, u in frames], dtype=np.float64)
+    data_manager = DataManager(make_data_path())
+
+    backends = [("keras", lambda: Brain(data_manager, model_path = args.model, realtime = True))]
+    for quantization in (None, "float16", "int8"):
+        backends.append(("tflite_" + (quantization or "float32"),
+                         lambda quantization = quantization: TFLiteBrain(data_manager, model_path = args.model, quantization = quantization,
+                                                                         sample_dir = args.calibration_dir or args.eslr_dir, num_threads = args.num_threads)))
+    report = {"frames" : len(frames), "backends" : {}}
+    reference = None
+    print("---------------------------")
+    for name, make_brain in backends:
+        t = perf_counter()
+        brain = make_brain()
+        load_time = perf_counter() - t
+        latencies, angles = run(brain, frames)
+        if reference is None:
+            reference = angles
+        p50, p95 = np.percentile(latencies, [50, 95])
+        result = {
+            "load_s" : load_time,
+            "latency_p50_ms" : float(p50),
+            "latency_p95_ms" : float(p95),
+            "mae_vs_keras" : float(np.mean(np.abs(angles - reference))),
+            "max_error_vs_keras" : float(np.max(np.abs(angles - reference))),
+        }
+        if not np.all(np.isnan(user_angles)):
+            result["mae_vs_user"] = float(np.nanmean(np.abs(angles - user_angles)))
+        if hasattr(brain, "tflite_path"):
+            result["size_kb"] = os.path.getsize(brain.tflite_path) // 1024
+        report["backends"][name] = result
+        print("[INFO]", name.ljust(15), ": p50 =", round(p50, 3), "ms / p95 =", round(p95, 3), "ms / MAE vs keras =", round(result["mae_vs_keras"], 5),
+              "/ max error =", round(result["max_error_vs_keras"], 5), "/ MAE vs user =", round(result.get("mae_vs_user", float("nan")), 5),
+              "/ size =", result.get("size_kb", "-"), "KB")
+
+    output = args.output or os.path.join(args.model, "tflite_report.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("[INFO] Report written :", output)
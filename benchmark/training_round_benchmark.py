@@ -0,0 +1,82 @@
+"""
+Training round benchmark
+
+Simulate several driving sessions of --session-size recorded frames, and after
+each one run a training round as the controller does (make the dataset, train,
+add the samples to the common pot), with the full dataset (make_dataset) then
+with the incremental dataset (make_incremental_dataset + replay buffer),
+and report the time of each round.
+
+Usage :
+    python benchmark/training_round_benchmark.py --model path/to/model --rounds 6 --session-size 500 --replay-size 1000
+"""
+
+import io
+import json
+import base64
+import argparse
+import numpy as np
+from time import perf_counter
+
+from common import make_data_path
+
+from PIL import Image
+from manager import DataManager
+from brain.brain import Brain
+
+def record_session(data_manager, nbr_frame, rng):
+    """
+    Write a session of random frames in the current sample file
+    """
+    for _ in range(nbr_frame):
+        img = (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(img).save(buffer, "JPEG")
+        d = {"msg_type" : "telemetry", "image" : base64.b64encode(buffer.getvalue()).decode("utf-8"), "speed" : float(rng.random() * 5),
+             "accel_x" : 0.0, "accel_y" : 0.0, "accel_z" : 0.0, "gyro_x" : 0.0, "gyro_y" : 0.0, "gyro_z" : float(rng.normal()),
+             "user_angle" : float(rng.normal() * 0.3), "user_throttle" : 0.3, "user_brake" : 0.0}
+        data_manager.sample_file.write((json.dumps(d) + "\n").encode("utf-8"))
+    data_manager.sample_count += nbr_frame
+
+def run(args, replay_size):
+    """
+    :param replay_size: None : make_dataset, otherwise make_incremental_dataset
+    :return: list of (samples seen, round time in s)
+    """
+    rng = np.random.default_rng(0)
+    data_manager = DataManager(make_data_path())
+    data_manager.next()
+    brain = Brain(data_manager, model_path = args.model, realtime = False, cache = False)
+    rounds = []
+    nbr_sample = 0
+    for _ in range(args.rounds):
+        record_session(data_manager, args.session_size, rng)
+        nbr_sample += args.session_size
+        data_manager.close()
+        t = perf_counter()
+        if replay_size is None:
+            train_dataset, test_dataset = data_manager.make_dataset()
+        else:
+            train_dataset, test_dataset = data_manager.make_incremental_dataset(replay_size = replay_size)
+        brain.train(train_dataset = train_dataset, test_dataset = test_dataset, nbr_epoch = args.epochs)
+        data_manager.add_to_common_pot()
+        if replay_size is not None:
+            data_manager.add_to_replay_buffer(replay_size = replay_size)
+        rounds.append((nbr_sample, perf_counter() - t))
+        data_manager.next()
+    data_manager.close()
+    return rounds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Training round benchmark")
+    parser.add_argument("--model", required=True, help="model dir (model.code + weights.data)")
+    parser.add_argument("--rounds", type=int, default=6, help="number of sessions")
+    parser.add_argument("--session-size", type=int, default=500, help="frames recorded by session")
+    parser.add_argument("--replay-size", type=int, default=1000, help="size of the replay buffer")
+    parser.add_argument("--epochs", type=int, default=1, help="epochs by round")
+    args = parser.parse_args()
+
+    results = {"full" : run(args, None), "incremental" : run(args, args.replay_size)}
+    print("---------------------------")
+    for name, rounds in results.items():
+        print("[INFO]", name.ljust(11), ":", " / ".join(str(n) + " samples : " + str(round(t, 1)) + " s" for n, t in rounds))
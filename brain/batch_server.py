@@ -0,0 +1,162 @@
+"""
+Batched inference shared by several cars
+
+Each Controller calls predict() as with a Brain (blocking), the server
+collects the frames of all the cars arriving within a time window and runs
+one forward pass for all of them (Brain.predict_batch), then gives each car
+its own (angle, throttle, brake).
+
+Usage :
+```
+    server = BatchInferenceServer(brain, window = 0.005, max_batch = len(clients))
+    controllers = [Controller(client = client, brain = server, ...) for client in clients]
+    ...
+    server.print_stats()
+    server.stop()
+```
+"""
+from collections import deque, Counter
+from threading import Thread, Condition, Event
+from time import perf_counter
+import numpy as np
+
+class PendingPrediction:
+    __slots__ = ("img", "speed_accel_gyro", "time", "done", "result", "error")
+
+    def __init__(self, img, speed_accel_gyro):
+        self.img = img
+        self.speed_accel_gyro = speed_accel_gyro
+        self.time = perf_counter()
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+class BatchInferenceServer:
+    def __init__(self, brain, window = 0.005, max_batch = 8, history = 10000):
+        """
+        :param brain: Brain (with predict_batch)
+        :param window: maximum wait (seconds) after the first pending frame for the frames of the other cars,
+                       larger : bigger batches (throughput), smaller : less latency
+        :param max_batch: the batch is run as soon as it has max_batch frames (ex: the number of cars)
+        :param history: number of batch sizes kept for the stats
+        """
+        self.brain = brain
+        self.window = window
+        self.max_batch = max_batch
+        self.cond = Condition()
+        self.pending = []
+        self.batch_sizes = deque(maxlen=history)
+        # time spent by the frames waiting for their batch
+        self.waits = deque(maxlen=history)
+
+        self.running = True
+        self.th = Thread(target=self.loop, daemon=True)
+        self.th.start()
+
+    def predict(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
+        """
+        Predict actions (same as Brain.predict, blocks until the batch of the frame is run)
+        :return (angle, throttle, brake)
+        """
+        request = PendingPrediction(img, (speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z))
+        with self.cond:
+            if not self.running:
+                raise Exception("BatchInferenceServer is stopped")
+            self.pending.append(request)
+            self.cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def swap_weights(self, model_path):
+        """
+        Swap the weights of the brain (see Brain.swap_weights)
+        """
+        self.brain.swap_weights(model_path)
+
+    def train(self, train_dataset, test_dataset, nbr_epoch = 4, time_budget = None, patience = None):
+        """
+        Train the brain (see Brain.train), for a Controller without trainer
+        The batches of the other cars keep running during the training
+        """
+        self.brain.train(train_dataset = train_dataset, test_dataset = test_dataset, nbr_epoch = nbr_epoch, time_budget = time_budget, patience = patience)
+
+    def next_batch(self):
+        """
+        Wait for a first frame, then for the window or a full batch
+        :return: list of PendingPrediction, empty when stopped
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.pending) > 0 or not self.running)
+            if not self.running:
+                return []
+            deadline = self.pending[0].time + self.window
+            while len(self.pending) < self.max_batch and self.running:
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            return batch
+
+    def loop(self):
+        while self.running:
+            batch = self.next_batch()
+            if len(batch) == 0:
+                continue
+            t = perf_counter()
+            try:
+                results = self.brain.predict_batch([r.img for r in batch], [r.speed_accel_gyro for r in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                print("[ERROR] Batch inference failed :", e)
+                for request in batch:
+                    request.error = e
+            self.batch_sizes.append(len(batch))
+            for request in batch:
+                self.waits.append(t - request.time)
+                request.done.set()
+
+    def stats(self):
+        """
+        :return: dict (number of batches, mean/max batch size, histogram of the sizes, wait p50/p95 in ms)
+        """
+        sizes = list(self.batch_sizes)
+        waits = np.array(list(self.waits)) * 1000
+        if len(sizes) == 0:
+            return {"batches" : 0}
+        p50, p95 = np.percentile(waits, [50, 95])
+        return {
+            "batches" : len(sizes),
+            "mean_size" : float(np.mean(sizes)),
+            "max_size" : max(sizes),
+            "sizes" : dict(sorted(Counter(sizes).items())),
+            "wait_p50" : float(p50),
+            "wait_p95" : float(p95),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        if stats["batches"] == 0:
+            print("[INFO] Batch inference : no batch")
+            return
+        print("[INFO] Batch inference :", stats["batches"], "batches / mean size =", round(stats["mean_size"], 2), "/ max size =", stats["max_size"],
+              "/ wait p50 =", round(stats["wait_p50"], 2), "ms / p95 =", round(stats["wait_p95"], 2), "ms")
+        print("[INFO] Batch sizes :", stats["sizes"])
+
+    def stop(self):
+        """
+        Stop the server, the pending frames fail
+        """
+        with self.cond:
+            self.running = False
+            pending = self.pending
+            self.pending = []
+            self.cond.notify_all()
+        for request in pending:
+            request.error = Exception("BatchInferenceServer is stopped")
+            request.done.set()
+        self.th.join()
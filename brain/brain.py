@@ -3,14 +3,41 @@ import tensorflow as tf
 from tensorflow import keras
 import os
 from .saver import ModelSaver
+from .cache import load_forward, save_forward
+from .callbacks import TrainingBudget
 import shutil
+from threading import Thread, local
 
 class Brain:
-    def __init__(self, data_manager):
-        self.model = None
-        self.load(data_manager.get_model_path())
+    def __init__(self, data_manager, model_path = None, realtime = True, cache = True):
+        """
+        :param model_path: model to load (default : data_manager.get_model_path())
+        :param realtime: predict with a traced forward function (fixed signature, preallocated inputs,
+                         normalization in the graph) instead of model.predict
+        :param cache: (realtime) load the forward function from the cache (see brain.cache),
+                      the Keras model is then built only when it is used (train, save, export)
+        """
         self.data_manager = data_manager
+        self._model = None
         self.model_path = None
+        self.DCModel = None
+        self.lr = 0.001
+        # last inputs given to the model, used to build a new model before a swap
+        self.last_inputs = None
+
+        self.realtime = realtime
+        self.cache = cache
+        self.forward = None
+        # SavedModel of the cached forward function (kept alive while forward is used)
+        self.forward_module = None
+        self.image_shape = tuple(data_manager.tensor_builder.image_shape)
+        # inputs used to trace the forward function
+        self.img_buffer = np.zeros((1,) + self.image_shape, dtype=np.uint8)
+        self.speed_accel_gyro_buffer = np.zeros((1, 7), dtype=np.float32)
+        # input buffers of predict (realtime), one pair by thread (several controllers may share the brain)
+        self.buffers = local()
+
+        self.load(data_manager.get_model_path() if model_path is None else model_path)
     
     def load(self, model_path, lr = 0.001):
         """
@@ -19,51 +46,195 @@ class Brain:
         """
         # self.model = keras.models.load_model(model_path)
         self.model_path = model_path
-        DCModel = ModelSaver.load(os.path.join(model_path, "model.code"))
-        self.model = DCModel()
-        self.model.load_weights(os.path.join(model_path, "weights.data"))
-        optimizer = keras.optimizers.Adam(learning_rate=lr)
-        self.model.compile(optimizer=optimizer,loss=keras.losses.MSE, metrics=["mse"])
+        self.lr = lr
+        self.DCModel = None
+        self._model = None
+        if self.realtime and self.cache:
+            self.forward_module = load_forward(model_path, self.image_shape, self.data_manager.get_cache_dir())
+            if self.forward_module is not None:
+                self.forward = self.forward_module.forward
+                self.forward(self.img_buffer, self.speed_accel_gyro_buffer)
+                return
+        self.model = self.build(model_path)
+        if self.realtime:
+            self.forward = self.make_forward(self.model)
+            if self.cache:
+                save_forward(self.forward, self.model, model_path, self.image_shape, self.data_manager.get_cache_dir())
+
+    @property
+    def model(self):
+        """
+        Keras model, built on first use when the forward function comes from the cache
+        """
+        if self._model is None and self.model_path is not None:
+            self._model = self.build(self.model_path)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def build(self, model_path):
+        """
+        Create a compiled instance of DCModel with the weights of model_path
+        """
+        if self.DCModel is None:
+            self.DCModel = ModelSaver.load(os.path.join(self.model_path, "model.code"))
+        model = self.DCModel()
+        model.load_weights(os.path.join(model_path, "weights.data"))
+        optimizer = keras.optimizers.Adam(learning_rate=self.lr)
+        model.compile(optimizer=optimizer,loss=keras.losses.MSE, metrics=["mse"])
+        return model
+
+    def make_forward(self, model):
+        """
+        Trace the forward pass of model for uint8 images (batch of any size)
+        The normalization of the image is done in the graph
+        :return: tf.function (img, speed_accel_gyro) -> dict of outputs
+        """
+        @tf.function(input_signature=[tf.TensorSpec((None,) + self.image_shape, tf.uint8), tf.TensorSpec((None, 7), tf.float32)])
+        def forward(img, speed_accel_gyro):
+            img = (tf.cast(img, tf.float32) / 127.5) - 1
+            return model({'input' : img, 'speed_accel_gyro' : speed_accel_gyro}, training=False)
+        # trace now, not on the first frame
+        forward(self.img_buffer, self.speed_accel_gyro_buffer)
+        return forward
+
+    def swap_weights(self, model_path):
+        """
+        Load the weights of model_path in a new model (in background)
+        then replace the current model, the predictions are never paused
+        :param model_path: directory path containing weights.data
+        """
+        Thread(target=self._swap_weights, args=(model_path,), daemon=True).start()
+
+    def _swap_weights(self, model_path):
+        if self.realtime and self.cache:
+            forward_module = load_forward(model_path, self.image_shape, self.data_manager.get_cache_dir())
+            if forward_module is not None:
+                forward_module.forward(self.img_buffer, self.speed_accel_gyro_buffer)
+                self.forward_module = forward_module
+                self.forward = forward_module.forward
+                # the Keras model of model_path is built if it is used
+                self.model_path = model_path
+                self._model = None
+                print("[INFO] Brain : weights swapped with", model_path, "(cache)")
+                return
+        model = self.build(model_path)
+        if self.realtime:
+            # the new forward is traced before being used to drive
+            forward = self.make_forward(model)
+            if self.cache:
+                save_forward(forward, model, model_path, self.image_shape, self.data_manager.get_cache_dir())
+            self.forward = forward
+        elif self.last_inputs is not None:
+            # build and trace the model before using it to drive
+            model.predict(self.last_inputs)
+        self.model = model
+        self.model_path = model_path
+        print("[INFO] Brain : weights swapped with", model_path)
 
     def save(self):
         """
         Save the brain like a SaveModel, weights.data and model.code
         :param path: directory path where we want save (directory already created)
         """
-        if self.model_path is not None:
-            shutil.copy(os.path.join(model_path, "model.code"), os.path.join(self.data_manager.get_model_path(), "model.code"))
+        os.makedirs(self.data_manager.get_model_path(), exist_ok=True)
+        if self.model_path is not None and os.path.abspath(self.model_path) != os.path.abspath(self.data_manager.get_model_path()):
+            shutil.copy(os.path.join(self.model_path, "model.code"), os.path.join(self.data_manager.get_model_path(), "model.code"))
         #self.model.save(self.data_manager.get_model_path())
         self.model.save_weights(os.path.join(self.data_manager.get_model_path(), "weights.data"))
 
+    def save_cache(self, model_path = None):
+        """
+        Trace the forward function of the model and save it in the cache entry of model_path
+        (ex: in the training worker, so the swap and the next launch load it directly)
+        :param model_path: saved model dir (default : data_manager.get_model_path())
+        """
+        model_path = self.data_manager.get_model_path() if model_path is None else model_path
+        save_forward(self.make_forward(self.model), self.model, model_path, self.image_shape, self.data_manager.get_cache_dir())
+
+    def export_tflite(self, path = None, quantization = None, sample_dir = None):
+        """
+        Export the model to TFLite (see brain.tflite.export_tflite)
+        :param quantization: None, "float16" or "int8" (calibrated on the frames of sample_dir)
+        :return: path of the .tflite file
+        """
+        from .tflite import export_tflite
+        return export_tflite(self, path, quantization = quantization, sample_dir = sample_dir)
+
     def predict(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):#XXX
         """
         Predict actions
         :return (angle, throttle, brake)
         """
+        if self.realtime:
+            img_buffer, speed_accel_gyro_buffer = self.input_buffers()
+            img_buffer[0] = img
+            speed_accel_gyro_buffer[0] = (speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)
+            output = self.forward(img_buffer, speed_accel_gyro_buffer)
+            return self.output_transformer({k : v.numpy() for k, v in output.items()})
         transformed_img, transformed_speed_accel_gyro = self.input_transformer(img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)
         #print(tf.shape(transformed_img), tf.shape(transformed_speed_accel_gyro))
-        output = self.model.predict({'input' : transformed_img, 'speed_accel_gyro':transformed_speed_accel_gyro})#XXX
+        self.last_inputs = {'input' : transformed_img, 'speed_accel_gyro':transformed_speed_accel_gyro}#XXX
+        output = self.model.predict(self.last_inputs)
         transformed_output = self.output_transformer(output)
         return transformed_output
     
-    def train(self, train_dataset, test_dataset, nbr_epoch = 4):
+    def input_buffers(self):
+        """
+        Input buffers of predict for the current thread, reused for each frame
+        :return: (img buffer, speed_accel_gyro buffer)
+        """
+        buffers = self.buffers
+        if not hasattr(buffers, "img"):
+            buffers.img = np.zeros((1,) + self.image_shape, dtype=np.uint8)
+            buffers.speed_accel_gyro = np.zeros((1, 7), dtype=np.float32)
+        return buffers.img, buffers.speed_accel_gyro
+
+    def predict_batch(self, imgs, speed_accel_gyro):
+        """
+        Predict actions for a batch of frames
+        :param imgs: list of images
+        :param speed_accel_gyro: list of (speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)
+        :return list of (angle, throttle, brake)
+        """
+        if self.realtime:
+            output = self.forward(np.stack(imgs), np.asarray(speed_accel_gyro, dtype=np.float32))
+            output = {k : v.numpy() for k, v in output.items()}
+            return [self.output_transformer({k: v[i:i+1] for k, v in output.items()}) for i in range(len(imgs))]
+        img_tensor = tf.convert_to_tensor(np.stack(imgs), dtype=tf.float32)
+        img_tensor = (img_tensor/127.5) - 1
+        speed_accel_gyro_tensor = tf.convert_to_tensor(speed_accel_gyro, dtype=tf.float32)
+        output = self.model.predict_on_batch({'input' : img_tensor, 'speed_accel_gyro' : speed_accel_gyro_tensor})
+        return [self.output_transformer({k: v[i:i+1] for k, v in output.items()}) for i in range(len(imgs))]
+
+    def train(self, train_dataset, test_dataset, nbr_epoch = 4, time_budget = None, patience = None):
         """
         Train model
         :params train_dataset:
         :params params: 
-        :params nbr_epoch: number of epochs
+        :params nbr_epoch: number of epochs (maximum with time_budget or patience)
+        :params time_budget: maximum duration of the training in seconds (None : no limit)
+        :params patience: stop when val_mse has not improved for patience epochs (None : no early stopping)
+        With time_budget or patience, the weights of the best epoch (val_mse) are kept (see brain.callbacks)
         """
-        history = self.model.fit(train_dataset, validation_data=test_dataset, epochs=nbr_epoch, verbose = 1)
-        self.data_manager.set_log(history)
+        budget = TrainingBudget(time_budget = time_budget, patience = patience, restore_best_weights = time_budget is not None or patience is not None)
+        history = self.model.fit(budget.count(train_dataset), validation_data=test_dataset, epochs=nbr_epoch, verbose = 1, callbacks = [budget])
+        self.data_manager.set_log(history, budget.summary())
         self.save()
+        if self.forward_module is not None:
+            # the cached forward has its own copy of the old weights : drive the trained model
+            self.forward = self.make_forward(self.model)
+            self.forward_module = None
     
     def input_transformer(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
         """
         Transform input before passing in arguments to predict/train function
         :return Tensor
         """
-        img = np.array(img)
-        img = np.array([img])
+        # add the batch dimension without copy (img may be a read-only frame)
+        img = np.asarray(img)[np.newaxis]
         img_tensor = tf.convert_to_tensor(img, dtype=tf.float32)
         #img_tensor = tf.image.rgb_to_grayscale(img_tensor) #XXX
         img_tensor = (img_tensor/127.5) - 1
@@ -0,0 +1,72 @@
+"""
+Startup cache of the forward function of a model
+
+Loading a Brain runs the source of model.code, builds DCModel, restores
+weights.data, compiles and traces the forward pass. The traced forward pass
+(see Brain.make_forward) and the weights are saved once as a SavedModel in
+a cache dir shared by all the sessions (DataManager.get_cache_dir), the next
+loads restore it directly without Keras.
+
+Each entry is named by a key (hash of model.code, of the weights files, of
+the image shape and of the TensorFlow version) : a copy of a model dir
+(DataManager.copy_model at each launch) finds the entry of the original,
+and a model trained again gets a new entry.
+"""
+import os
+import glob
+import shutil
+import hashlib
+import tensorflow as tf
+
+def cache_key(model_path, image_shape):
+    """
+    :return: hex digest of model.code, the weights files, the image shape and the TensorFlow version
+    """
+    h = hashlib.sha1()
+    h.update((tf.__version__ + str(tuple(image_shape))).encode("utf-8"))
+    paths = [os.path.join(model_path, "model.code")] + sorted(glob.glob(os.path.join(model_path, "weights.data*")))
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+def load_forward(model_path, image_shape, cache_dir):
+    """
+    Load the cached forward function of model_path
+    :param cache_dir: dir of the cache entries
+    :return: the loaded module (its forward attribute is the function), None if there is no entry
+    """
+    try:
+        path = os.path.join(cache_dir, cache_key(model_path, image_shape))
+        if not os.path.exists(path):
+            return None
+        return tf.saved_model.load(path)
+    except Exception as e:
+        print("[WARNING] Forward cache not loaded :", e)
+        return None
+
+def save_forward(forward, model, model_path, image_shape, cache_dir):
+    """
+    Save the traced forward function of model (and its weights) in the cache entry of model_path
+    A failure is only printed, the cache is an optimization
+    """
+    tmp_path = None
+    try:
+        path = os.path.join(cache_dir, cache_key(model_path, image_shape))
+        if os.path.exists(path):
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp" + str(os.getpid())
+        module = tf.Module()
+        module.forward = forward
+        # the variables captured by forward are saved with it
+        module.model_variables = list(model.variables)
+        tf.saved_model.save(module, tmp_path)
+        os.rename(tmp_path, path)
+        print("[INFO] Forward cache saved :", path)
+    except Exception as e:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        print("[WARNING] Forward cache not saved :", e)
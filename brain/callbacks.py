@@ -0,0 +1,111 @@
+"""
+Training round with a wall-clock budget
+
+TrainingBudget stops Brain.train when :
+    - the time budget is spent ("time_budget") : checked after each batch, and an
+      epoch is not started when the previous one shows it would end after the budget
+    - val_mse has not improved for patience epochs ("early_stopping")
+    - all the epochs are done ("epochs")
+then restores the weights of the epoch with the best val_mse, and gives a summary
+(stop reason, epochs, best epoch, samples/sec) recorded by DataManager.set_log.
+"""
+from time import perf_counter
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+class TrainingBudget(keras.callbacks.Callback):
+    def __init__(self, time_budget = None, patience = None, min_delta = 0, monitor = "val_mse", restore_best_weights = True):
+        """
+        :param time_budget: maximum duration of the training (seconds, None : no limit)
+        :param patience: number of epochs without improvement of monitor before stopping (None : no early stopping)
+        :param min_delta: minimum decrease of monitor counted as an improvement
+        :param restore_best_weights: set the weights of the best epoch at the end of the training
+        """
+        super().__init__()
+        self.time_budget = time_budget
+        self.patience = patience
+        self.min_delta = min_delta
+        self.monitor = monitor
+        self.restore_best_weights = restore_best_weights
+        # samples given to the model, counted in the input pipeline (see count)
+        self.samples = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+    def count(self, dataset):
+        """
+        :param dataset: batched train dataset (inputs, outputs)
+        :return: the same dataset, counting its samples
+        """
+        def count_map_func(inputs, outputs):
+            self.samples.assign_add(tf.cast(tf.shape(tf.nest.flatten(outputs)[0])[0], tf.int64))
+            return inputs, outputs
+        return dataset.map(count_map_func)
+
+    def on_train_begin(self, logs = None):
+        self.start = perf_counter()
+        self.epoch_start = self.start
+        self.samples.assign(0)
+        self.stop_reason = "epochs"
+        self.epochs = 0
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+        self.wait = 0
+
+    def on_epoch_begin(self, epoch, logs = None):
+        self.epoch_start = perf_counter()
+
+    def on_train_batch_end(self, batch, logs = None):
+        if self.time_budget is not None and perf_counter() - self.start >= self.time_budget:
+            self.stop("time_budget")
+
+    def on_epoch_end(self, epoch, logs = None):
+        self.epochs = epoch + 1
+        value = (logs or {}).get(self.monitor)
+        if value is not None:
+            if value < self.best - self.min_delta:
+                self.best = value
+                self.best_epoch = epoch
+                self.wait = 0
+                if self.restore_best_weights:
+                    self.best_weights = self.model.get_weights()
+            else:
+                self.wait += 1
+                if self.patience is not None and self.wait >= self.patience:
+                    self.stop("early_stopping")
+        if self.time_budget is not None:
+            now = perf_counter()
+            # the next epoch is expected to last as long as this one
+            if now + (now - self.epoch_start) - self.start > self.time_budget:
+                self.stop("time_budget")
+
+    def stop(self, reason):
+        if not self.model.stop_training:
+            self.stop_reason = reason
+            self.model.stop_training = True
+
+    def on_train_end(self, logs = None):
+        self.train_time = perf_counter() - self.start
+        if self.best_weights is not None and self.best_epoch != self.epochs - 1:
+            self.model.set_weights(self.best_weights)
+            print("[INFO] Best weights restored (epoch", str(self.best_epoch + 1) + ")")
+        summary = self.summary()
+        print("[INFO] Training stopped :", summary["stop_reason"], "/", summary["epochs"], "epochs in", round(summary["train_time"], 1),
+              "s /", round(summary["samples_per_sec"], 1), "samples/s / best", self.monitor, "=", summary["best_" + self.monitor])
+
+    def summary(self):
+        """
+        :return: dict (stop reason, epochs, best epoch and monitor value, train time, samples, samples/sec, parameters)
+        """
+        samples = int(self.samples.numpy())
+        return {
+            "stop_reason" : self.stop_reason,
+            "epochs" : self.epochs,
+            "best_epoch" : None if self.best_epoch is None else self.best_epoch + 1,
+            "best_" + self.monitor : None if self.best_epoch is None else float(self.best),
+            "train_time" : self.train_time,
+            "samples" : samples,
+            "samples_per_sec" : samples / self.train_time if self.train_time > 0 else 0.0,
+            "time_budget" : self.time_budget,
+            "patience" : self.patience,
+        }
@@ -0,0 +1,135 @@
+"""
+Shadow inference for DAgger-style recording
+
+While the user drives, the brain predicts the same frames in a worker thread
+and only the frames where the brain disagrees with the user are recorded.
+The control loop only puts the frames in a bounded queue (never blocks).
+"""
+import queue
+from threading import Thread
+from time import time
+
+class ShadowPredictor:
+    def __init__(self, brain, data_manager, batch_size = 8, max_queue = 64, threshold = 0.1, delay = 1/50):
+        """
+        :param brain: Brain used for the predictions
+        :param data_manager: DataManager where the disagreeing frames are recorded
+        :param batch_size: maximum number of frames predicted at once
+        :param max_queue: maximum number of frames waiting, the new frames are dropped when full
+        :param threshold: minimum difference of angle between the user and the brain to record the frame
+        :param delay: minimum delay between two recorded frames (time of the frames)
+        """
+        self.brain = brain
+        self.data_manager = data_manager
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.delay = delay
+        self.queue = queue.Queue(maxsize = max_queue)
+
+        # frames submitted, dropped (queue full), predicted and recorded
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.recorded = 0
+        self.last_submitted_version = 0
+        self.last_processed_version = 0
+
+        self.running = True
+        self.th = Thread(target=self.loop, daemon=True)
+        self.th.start()
+
+    def submit(self, version, img, telemetry, raw, angle, throttle, brake):
+        """
+        Give a frame and the user command to check (never blocks)
+        :param version: version of the frame (FrameStore)
+        :param img: frame (read-only numpy array, not copied)
+        :param telemetry: Telemetry of the frame
+        :param raw: json bytes of the telemetry (Client.get_telemetry_frame)
+        :return: False if the frame has been dropped
+        """
+        self.last_submitted_version = version
+        try:
+            self.queue.put_nowait((time(), version, img, telemetry, raw, angle, throttle, brake))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def next_batch(self):
+        """
+        Wait for a frame then take the frames already waiting (up to batch_size)
+        :return: list of items, empty when stopped
+        """
+        item = self.queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.running = False
+                break
+            batch.append(item)
+        return batch
+
+    def loop(self):
+        while self.running:
+            batch = self.next_batch()
+            if len(batch) == 0:
+                break
+            try:
+                predictions = self.brain.predict_batch([item[2] for item in batch],
+                                                       [item[3].speed_accel_gyro() for item in batch])
+            except Exception as e:
+                print("[ERROR] Shadow prediction failed :", e)
+                self.processed += len(batch)
+                self.last_processed_version = batch[-1][1]
+                continue
+            for item, (angle_p, throttle_p, brake_p) in zip(batch, predictions):
+                t, version, img, telemetry, raw, angle, throttle, brake = item
+                if abs(angle - angle_p) > self.threshold:
+                    count = self.data_manager.sample_count
+                    self.data_manager.append_raw_sample(raw, angle, throttle, brake, delay = self.delay, t = t)
+                    if self.data_manager.sample_count != count:
+                        self.recorded += 1
+                self.last_processed_version = version
+            self.processed += len(batch)
+
+    def lag(self):
+        """
+        How far the shadow predictions are behind the driving
+        :return: dict (frames waiting, age in seconds of the oldest waiting frame, frames behind the latest submitted one)
+        """
+        with self.queue.mutex:
+            oldest = self.queue.queue[0] if len(self.queue.queue) > 0 else None
+            pending = len(self.queue.queue)
+        return {
+            "pending" : pending,
+            "age" : 0 if oldest is None else time() - oldest[0],
+            "behind" : max(0, self.last_submitted_version - self.last_processed_version),
+        }
+
+    def summary(self):
+        """
+        :return: lag and counters of the shadow
+        """
+        summary = self.lag()
+        summary.update({"submitted" : self.submitted, "dropped" : self.dropped, "processed" : self.processed, "recorded" : self.recorded})
+        return summary
+
+    def stop(self):
+        """
+        Stop the worker, the frames still waiting are not predicted
+        """
+        self.running = False
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(None)
+        self.th.join()
@@ -0,0 +1,184 @@
+"""
+TFLite export and inference backend
+
+The DCModel of a Brain (model.code + weights.data) is exported to a TFLite
+flatbuffer, optionally quantized after training :
+    - "float16" : weights stored as float16
+    - "int8"    : weights and activations as int8, calibrated on frames of a sample dir
+The exported function takes the uint8 image (normalization in the graph)
+and speed_accel_gyro, with a batch of 1.
+
+TFLiteBrain drives the car from the TFLite interpreter (same predict as Brain).
+"""
+import os
+import csv
+import json
+import glob
+import random
+from threading import Lock, Thread
+import numpy as np
+import tensorflow as tf
+
+from .brain import Brain
+from core.frame import decode_image
+
+QUANTIZATIONS = (None, "float16", "int8")
+
+SPEED_ACCEL_GYRO = ("speed", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z")
+
+def load_sample_frames(sample_dir, nbr_frame = 200, seed = 0):
+    """
+    Read frames of a sample dir, from its label.csv (extracted samples) or its .eslr files
+    :return: list of (img, speed_accel_gyro, user_angle or None)
+    """
+    frames = []
+    csv_path = os.path.join(sample_dir, "label.csv")
+    if os.path.exists(csv_path):
+        from PIL import Image
+        with open(csv_path, "r") as f:
+            rows = list(csv.DictReader(f))
+        random.Random(seed).shuffle(rows)
+        for row in rows[:nbr_frame]:
+            img = np.asarray(Image.open(row["path"]), dtype=np.uint8)
+            user_angle = float(row["user_angle"]) if "user_angle" in row else None
+            frames.append((img, tuple(float(row.get(k, 0)) for k in SPEED_ACCEL_GYRO), user_angle))
+        return frames
+    lines = []
+    for eslr_path in sorted(glob.glob(os.path.join(sample_dir, "*.eslr"))):
+        with open(eslr_path, "r") as f:
+            lines += [line for line in f if '"telemetry"' in line]
+    random.Random(seed).shuffle(lines)
+    for line in lines[:nbr_frame]:
+        j = json.loads(line)
+        frames.append((decode_image(j["image"]), tuple(float(j.get(k, 0)) for k in SPEED_ACCEL_GYRO), j.get("user_angle")))
+    return frames
+
+def export_tflite(brain, path = None, quantization = None, sample_dir = None, nbr_calibration = 200):
+    """
+    Export the model of a Brain to TFLite
+    :param brain: Brain
+    :param path: .tflite file (default : model_<quantization>.tflite in brain.model_path)
+    :param quantization: None, "float16" or "int8"
+    :param sample_dir: frames used to calibrate the int8 quantization (label.csv or .eslr)
+    :param nbr_calibration: number of calibration frames
+    :return: path of the .tflite file
+    """
+    if quantization not in QUANTIZATIONS:
+        raise Exception("Unknown quantization : " + str(quantization))
+    if path is None:
+        path = os.path.join(brain.model_path, "model_" + (quantization or "float32") + ".tflite")
+    model = brain.model
+
+    @tf.function(input_signature=[tf.TensorSpec((1,) + brain.image_shape, tf.uint8, name="img"), tf.TensorSpec((1, 7), tf.float32, name="speed_accel_gyro")])
+    def forward(img, speed_accel_gyro):
+        img = (tf.cast(img, tf.float32) / 127.5) - 1
+        return model({'input' : img, 'speed_accel_gyro' : speed_accel_gyro}, training=False)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([forward.get_concrete_function()], model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if sample_dir is None:
+            raise Exception("The int8 quantization needs a sample dir to calibrate")
+        frames = load_sample_frames(sample_dir, nbr_calibration)
+        if len(frames) == 0:
+            raise Exception("No calibration frames in " + sample_dir)
+        def representative_dataset():
+            for img, speed_accel_gyro, _ in frames:
+                yield {"img" : img[np.newaxis], "speed_accel_gyro" : np.array([speed_accel_gyro], dtype=np.float32)}
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+    flatbuffer = converter.convert()
+    with open(path, "wb") as f:
+        f.write(flatbuffer)
+    print("[INFO] TFLite model exported :", path, "(" + str(len(flatbuffer) // 1024), "KB)")
+    return path
+
+class TFLiteBrain(Brain):
+    """
+    Brain predicting with the TFLite interpreter (inference only, no train)
+    """
+    def __init__(self, data_manager, model_path = None, quantization = None, sample_dir = None, tflite_path = None, num_threads = None):
+        """
+        :param model_path: model dir (model.code + weights.data), exported if its .tflite does not exist
+        :param quantization: None, "float16" or "int8" (see export_tflite)
+        :param sample_dir: calibration frames for int8
+        :param tflite_path: .tflite file to load (default : the one of model_path and quantization)
+        :param num_threads: threads of the interpreter (None : TFLite default)
+        """
+        self.data_manager = data_manager
+        self.quantization = quantization
+        self.sample_dir = sample_dir
+        self.num_threads = num_threads
+        self.image_shape = tuple(data_manager.tensor_builder.image_shape)
+        self.model_path = data_manager.get_model_path() if model_path is None else model_path
+        # the interpreter is used by one thread at a time
+        self.lock = Lock()
+        self.img_buffer = np.zeros((1,) + self.image_shape, dtype=np.uint8)
+        self.speed_accel_gyro_buffer = np.zeros((1, 7), dtype=np.float32)
+        self.interpreter = None
+        self.load_tflite(tflite_path or self.export(self.model_path))
+
+    def export(self, model_path):
+        """
+        Export the model of model_path if its .tflite does not exist yet
+        :return: path of the .tflite file
+        """
+        path = os.path.join(model_path, "model_" + (self.quantization or "float32") + ".tflite")
+        if not os.path.exists(path):
+            brain = Brain(self.data_manager, model_path = model_path, realtime = True)
+            export_tflite(brain, path, quantization = self.quantization, sample_dir = self.sample_dir)
+        return path
+
+    def load_tflite(self, path):
+        interpreter = tf.lite.Interpreter(model_path = path, num_threads = self.num_threads)
+        interpreter.allocate_tensors()
+        runner = interpreter.get_signature_runner()
+        inputs = runner.get_input_details()
+        outputs = runner.get_output_details()
+        with self.lock:
+            self.interpreter = interpreter
+            self.img_index = inputs["img"]["index"]
+            self.speed_accel_gyro_index = inputs["speed_accel_gyro"]["index"]
+            self.output_indexes = {name : details["index"] for name, details in outputs.items()}
+            self.tflite_path = path
+
+    def predict(self, img, speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
+        """
+        Predict actions
+        :return (angle, throttle, brake)
+        """
+        with self.lock:
+            self.img_buffer[0] = img
+            self.speed_accel_gyro_buffer[0] = (speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)
+            interpreter = self.interpreter
+            interpreter.set_tensor(self.img_index, self.img_buffer)
+            interpreter.set_tensor(self.speed_accel_gyro_index, self.speed_accel_gyro_buffer)
+            interpreter.invoke()
+            output = {name : interpreter.get_tensor(index) for name, index in self.output_indexes.items()}
+        return self.output_transformer(output)
+
+    def predict_batch(self, imgs, speed_accel_gyro):
+        """
+        Predict actions for several frames (one invoke by frame, the model has a batch of 1)
+        :return list of (angle, throttle, brake)
+        """
+        return [self.predict(img, *values) for img, values in zip(imgs, speed_accel_gyro)]
+
+    def swap_weights(self, model_path):
+        """
+        Export the new model (in background) then replace the interpreter
+        """
+        Thread(target=self._swap_weights, args=(model_path,), daemon=True).start()
+
+    def _swap_weights(self, model_path):
+        self.load_tflite(self.export(model_path))
+        self.model_path = model_path
+        print("[INFO] TFLiteBrain : model swapped with", self.tflite_path)
+
+    def train(self, train_dataset, test_dataset, nbr_epoch = 4, time_budget = None, patience = None):
+        raise Exception("TFLiteBrain can not be trained, use a BackgroundTrainer")
+
+    def save(self):
+        raise Exception("TFLiteBrain can not be saved")
@@ -0,0 +1,145 @@
+"""
+Background training
+
+The samples of the closed session are trained in a separate python process
+while the current brain keeps driving. When the training is finished, the new
+weights are swapped into the live brain (Brain.swap_weights).
+
+The worker is started as `python -m brain.trainer <json config>` from the root
+of the project (and not with multiprocessing) so the launch script is not
+executed again in the worker.
+"""
+import os
+import sys
+import json
+import subprocess
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+class BackgroundTrainer:
+    """
+    Train the brain in a worker process
+
+    Usage (in the control loop) :
+    ```
+        if train_button:
+            trainer.start()
+        model_path = trainer.poll()
+        if model_path is not None:
+            brain.swap_weights(model_path)
+    ```
+    """
+    def __init__(self, data_manager, brain, nbr_epoch = 5, replay_size = None, time_budget = None, patience = None):
+        """
+        :param nbr_epoch: number of epochs (maximum with time_budget or patience)
+        :param replay_size: incremental training, fine-tune on the session mixed with a replay buffer
+                            of replay_size past samples (None : DataManager.make_dataset)
+        :param time_budget: maximum duration of a training in seconds (None : no limit)
+        :param patience: stop when val_mse has not improved for patience epochs (None : no early stopping)
+        """
+        self.data_manager = data_manager
+        self.brain = brain
+        self.nbr_epoch = nbr_epoch
+        self.replay_size = replay_size
+        self.time_budget = time_budget
+        self.patience = patience
+
+        self.process = None
+        self.log_file = None
+        self.log_path = None
+        self.model_path = None
+
+    def is_running(self):
+        return self.process is not None
+
+    def start(self):
+        """
+        Close the current samples, start the training on them and open
+        the next session dir so the recording continues
+        :return: True if the training has been started
+        """
+        if self.is_running():
+            print("[WARNING] A training is already running")
+            return False
+        data_manager = self.data_manager
+        data_manager.close()
+        tensor_builder = data_manager.tensor_builder
+        config = {
+            "data_path" : data_manager.data_path,
+            "uid" : data_manager.uid,
+            "id" : data_manager.id,
+            "sample_base" : data_manager.sample_base,
+            "input_label" : tensor_builder.input_label,
+            "output_label" : tensor_builder.output_label,
+            "num_parallel_calls" : tensor_builder.num_parallel_calls,
+            "image_shape" : list(tensor_builder.image_shape),
+            "source_model_path" : self.brain.model_path,
+            "nbr_epoch" : self.nbr_epoch,
+            "replay_size" : self.replay_size,
+            "time_budget" : self.time_budget,
+            "patience" : self.patience,
+        }
+        self.model_path = data_manager.get_model_path()
+        self.log_path = os.path.join(data_manager.get_dir("log"), "trainer.log")
+        self.log_file = open(self.log_path, "w")
+        data_manager.next()
+
+        self.process = subprocess.Popen([sys.executable, "-m", "brain.trainer", json.dumps(config)],
+                                        cwd = ROOT_PATH, stdout = self.log_file, stderr = subprocess.STDOUT)
+        print("[INFO] Training started in background (pid", str(self.process.pid) + ")")
+        return True
+
+    def poll(self):
+        """
+        Check the worker (never blocks)
+        :return: path of the new model when the training has just finished, otherwise None
+        """
+        if self.process is None or self.process.poll() is None:
+            return None
+        returncode = self.process.returncode
+        self.process = None
+        self.log_file.close()
+        self.log_file = None
+        if returncode != 0:
+            print("[ERROR] Background training failed, see", self.log_path)
+            return None
+        print("[INFO] Background training finished :", self.model_path)
+        return self.model_path
+
+    def stop(self):
+        """
+        Kill the worker if it is running
+        """
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            self.log_file.close()
+            self.log_file = None
+
+def train_worker(config):
+    """
+    Train on the samples of config["id"] and save the model in its model dir
+    """
+    from manager import DataManager
+    from brain.brain import Brain
+
+    data_manager = DataManager(config["data_path"], begin_id = config["id"], input_label = config["input_label"], output_label = config["output_label"],
+                               num_parallel_calls = config["num_parallel_calls"], image_shape = tuple(config["image_shape"]), uid = config["uid"])
+    data_manager.sample_base = config["sample_base"]
+    brain = Brain(data_manager, model_path = config["source_model_path"], realtime = False)
+    replay_size = config.get("replay_size")
+    if replay_size is None:
+        train_dataset, test_dataset = data_manager.make_dataset()
+    else:
+        train_dataset, test_dataset = data_manager.make_incremental_dataset(replay_size = replay_size)
+    brain.train(train_dataset = train_dataset, test_dataset = test_dataset, nbr_epoch = config["nbr_epoch"],
+                time_budget = config.get("time_budget"), patience = config.get("patience"))
+    # traced here so the swap in the driving process loads it without building the model
+    brain.save_cache()
+    data_manager.add_to_common_pot()
+    if replay_size is not None:
+        data_manager.add_to_replay_buffer(replay_size = replay_size)
+
+if __name__ == "__main__":
+    train_worker(json.loads(sys.argv[1]))
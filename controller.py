@@ -1,13 +1,24 @@
 from threading import Thread
-import json
-import cv2
-import numpy as np
-import os
-from time import time
-os.environ['DISPLAY'] = ':1'
 
 class Controller:
-    def __init__(self, client, hardware, data_manager, brain = None, autopilote = True, car_config = None):
+    def __init__(self, client, hardware, data_manager, brain = None, autopilote = True, car_config = None, tracer = None, frame_driven = True, frame_timeout = 0.05, headless = False, display_rate = 20, trainer = None, shadow = None, stats = None, profiler = None, nbr_epoch = 5, replay_size = None, time_budget = None, patience = None):
+        """
+            :param frame_driven: run the driving once per new frame (woken by the client)
+                                 instead of running it on each iteration of the loop
+            :param frame_timeout: maximum wait for a new frame before checking the hardware again
+            :param headless: no camera preview (OpenCV and X11 are not needed)
+            :param display_rate: maximum refresh rate of the camera preview
+            :param trainer: BackgroundTrainer, train in a worker process while driving (None : train in the loop)
+            :param shadow: ShadowPredictor, check the disagreement brain/user off the control loop
+                           in manual mode with record (None : predict in the loop)
+            :param stats: DrivingStats (None : summary printed every 10s)
+            :param profiler: SessionProfiler, started by the profile control of the hardware (None : no profiling)
+            :param nbr_epoch: number of epochs of a training in the loop (maximum with time_budget or patience)
+            :param replay_size: incremental training in the loop (without trainer), fine-tune on the session mixed
+                                with a replay buffer of replay_size past samples (None : DataManager.make_dataset)
+            :param time_budget: maximum duration of a training in the loop in seconds, while the car is stopped (None : no limit)
+            :param patience: stop the training in the loop when val_mse has not improved for patience epochs (None : no early stopping)
+        """
         self.client = client
         self.hardware = hardware
         self.brain = brain
@@ -16,20 +27,42 @@ class Controller:
         self.autopilote = autopilote
         self.running = True
 
-        self.is_passed_once = False
-        self.last_node = 0
-        self.number_turn = -1
-        self.time_last_turn = 0
-        self.time_ref = None
-
         self.car_is_driving = False
         self.car_config = car_config
+        self.tracer = tracer
+        self.trainer = trainer
+        self.shadow = shadow
+        self.profiler = profiler
+        self.nbr_epoch = nbr_epoch
+        self.replay_size = replay_size
+        self.time_budget = time_budget
+        self.patience = patience
 
-        self.controller_thread = Thread(target=self.loop)
-        self.controller_thread.start()
+        self.frame_driven = frame_driven
+        self.frame_timeout = frame_timeout
+        self.last_frame_version = 0
+        # frames processed, frames never processed (a newer one was available)
+        # and wake up without new frame
+        self.processed_frames = 0
+        self.skipped_frames = 0
+        self.duplicate_frames = 0
+
+        # laps, FPS and controls, printed every 10s by default (not in the loop)
+        if stats is None:
+            from utils.stats import DrivingStats
+            stats = DrivingStats()
+        self.stats = stats
+        self.stats.add_source("frames", self.frame_counters)
+        if self.shadow is not None:
+            self.stats.add_source("shadow", self.shadow.summary)
 
-        self.last_time = None
-        self.fps = 0
+        self.display = None
+        if not headless:
+            from utils.display import Display
+            self.display = Display(refresh_rate = display_rate)
+
+        self.controller_thread = Thread(target=self.loop, name="controller")
+        self.controller_thread.start()
     
     def loop(self):
         """
@@ -38,93 +71,123 @@ class Controller:
         if self.car_config is not None:
             self.client.send_car_config(*self.car_config)# Car Name
         while self.running:
-            ### Stats ###
-            # Count number of turn
-            # Print Active Node and Cumulative time of last turn
-            if self.client.data is not None:
-                current_node = self.client.data['activeNode']
-                current_time = self.client.data['time']
-                if self.last_node > 110 and current_node < 3 and not self.is_passed_once:
-                    print(">>>>>> ", self.last_node, current_node, self.is_passed_once)
-                    self.number_turn += 1
-                    if self.number_turn == 0:
-                        self.time_ref = current_time
-                    self.last_node = current_node
-                    self.is_passed_once = True
-                    self.time_last_turn = current_time - self.time_ref
-                if current_node > 3:
-                    self.is_passed_once = False
-                self.last_node = current_node
-                print("[INFO]", "turn = ", self.number_turn, "/ activeNode =", current_node, "/ Cumulative time since last turn =", self.time_last_turn)
-            ### End of stats ###
-            if self.client.img is not None:
-                ### FPS
-                if self.last_time == None :
-                    self.last_time = time()
+            new_frame = self.wait_frame()
+            # read all the inputs once for this iteration
+            self.hardware.tick()
+            if self.profiler is not None:
+                self.profiler.checkpoint()
+                if self.hardware.get_profile_controller():
+                    self.profiler.trigger()
+            if new_frame and self.client.frames.get_version() > 0:
+                telemetry = self.client.telemetry
+                if telemetry is not None:
+                    self.stats.update(telemetry)
+                self.stats.frame()
+                if self.display is not None:
+                    # the frame is decoded here only if the preview is shown
+                    self.display.show(self.client.img)
+            if new_frame:
+                if self.hardware.get_autodrive_controller():
+                    self.manual_mode(record = True)
+                elif self.autopilote:
+                    if self.car_is_driving or self.hardware.get_start_car():
+                        self.car_is_driving = True
+                        self.auto_mode()
                 else:
-                    current_time = time()
-                    delta = current_time - self.last_time
-                    if delta >= 10:
-                        print("---------------------------")
-                        print("FPS : ", self.fps/delta)
-                        self.last_time = time()
-                        self.fps = 0
-                    else:
-                        self.fps += 1
-                ###
-                cv2.imshow('view', cv2.cvtColor(np.array(self.client.img), cv2.COLOR_BGR2RGB))
-                cv2.waitKey(1)
-            if self.hardware.get_autodrive_controller():
-                self.manual_mode(record = True)
-            elif self.autopilote:
-                if self.car_is_driving or self.hardware.get_start_car():
-                    self.car_is_driving = True
-                    self.auto_mode()
-            else:
-                self.manual_mode(record = False)
-            if self.hardware.get_rec_controller():
+                    self.manual_mode(record = False)
+            if new_frame and self.hardware.get_rec_controller():
                 #
                 angle = self.hardware.get_angle_controller()
                 throttle = self.hardware.get_throttle_controller()
                 brake = self.hardware.get_brake_controller()
-                self.client.data['user_angle'] = angle
-                self.client.data['user_throttle'] = throttle
-                self.client.data['user_brake'] = brake
-                self.data_manager.append_sample(json.dumps(self.client.data), delay = 1/20, debug = True)
+                raw = self.client.get_telemetry()[2]
+                if raw is not None:
+                    self.data_manager.append_raw_sample(raw, angle, throttle, brake, delay = 1/20)
+            if self.trainer is not None:
+                model_path = self.trainer.poll()
+                if model_path is not None:
+                    self.brain.swap_weights(model_path)
             if self.hardware.get_train_controller():
-                if self.data_manager.sample_count != 0:
+                if self.trainer is not None:
+                    if self.data_manager.sample_count != 0:
+                        # the current brain keeps driving during the training
+                        self.trainer.start()
+                elif self.data_manager.sample_count != 0:
                     self.data_manager.close()
                     self.client.send_car_control(0, 0, 1)
-                    train_dataset, test_dataset = self.data_manager.make_dataset()
-                    self.brain.train(train_dataset = train_dataset, test_dataset = test_dataset, nbr_epoch= 5)
+                    if self.replay_size is None:
+                        train_dataset, test_dataset = self.data_manager.make_dataset()
+                    else:
+                        train_dataset, test_dataset = self.data_manager.make_incremental_dataset(replay_size = self.replay_size)
+                    self.brain.train(train_dataset = train_dataset, test_dataset = test_dataset, nbr_epoch= self.nbr_epoch, time_budget = self.time_budget, patience = self.patience)
                     self.data_manager.add_to_common_pot()
+                    if self.replay_size is not None:
+                        self.data_manager.add_to_replay_buffer(replay_size = self.replay_size)
                     self.data_manager.next()
                     self.client.send_reset()
             if self.hardware.get_reset_controller():
                 self.car_is_driving = False
                 self.client.send_reset()
-
-                # Reset stats
-                self.is_passed_once = False
-                self.last_node = 0
-                self.number_turn = -1
-                self.time_last_turn = 0
-                self.time_ref = None
+                self.stats.reset_laps()
 
             if self.hardware.get_exit_app_controller():
+                if self.tracer is not None:
+                    self.tracer.stop()
+                if self.display is not None:
+                    self.display.stop()
+                if self.trainer is not None:
+                    self.trainer.stop()
+                if self.shadow is not None:
+                    self.shadow.stop()
+                self.stats.stop()
+                if self.profiler is not None:
+                    self.profiler.stop()
+                self.hardware.stop()
                 self.client.stop()
                 self.running = False
                 exit()
     
+    def frame_counters(self):
+        return {"processed" : self.processed_frames, "skipped" : self.skipped_frames, "duplicate" : self.duplicate_frames}
+
+    def wait_frame(self):
+        """
+            Wait for a new frame from the client (frame driven mode)
+            :return: True if a new frame has to be processed
+        """
+        if not self.frame_driven:
+            return True
+        version = self.client.wait_frame(self.last_frame_version, timeout = self.frame_timeout)
+        if version == self.last_frame_version:
+            self.duplicate_frames += 1
+            return False
+        if version > self.last_frame_version:
+            # intermediate frames arrived while we were busy : they are dropped
+            self.skipped_frames += version - self.last_frame_version - 1
+        self.last_frame_version = version
+        self.processed_frames += 1
+        return True
+
     def auto_mode(self):
         """
             Auto mode
             The brain predict and drive the car
         """
-        if self.client.img is not None and self.client.data is not None:#
-            angle, throttle, brake = self.brain.predict(self.client.img, self.client.data['speed'], self.client.data['accel_x'], self.client.data['accel_y'], self.client.data['accel_z'], self.client.data['gyro_x'], self.client.data['gyro_y'], self.client.data['gyro_z'])
-            print(angle, throttle, brake)
+        version, img, telemetry, _ = self.client.get_telemetry_frame()
+        if img is not None:#
+            self.stamp(version, "inference_start")
+            angle, throttle, brake = self.brain.predict(img, telemetry.speed, telemetry.accel_x, telemetry.accel_y, telemetry.accel_z, telemetry.gyro_x, telemetry.gyro_y, telemetry.gyro_z)
+            self.stamp(version, "inference_end")
             self.client.send_car_control(angle, throttle, brake)
+            self.stamp(version, "send")
+            self.stats.control(angle, throttle, brake)
+
+    def stamp(self, version, stage):
+        """
+            Stamp a stage of the frame in the latency tracer (if any)
+        """
+        if self.tracer is not None:
+            self.tracer.stamp(version, stage)
 
     def manual_mode(self, record = False):
         """
@@ -135,13 +198,17 @@ class Controller:
         throttle = self.hardware.get_throttle_controller()
         brake = self.hardware.get_brake_controller()
         self.client.send_car_control(angle, throttle, brake)
-        if record and self.brain is not None and self.client.img is not None:
-            #
-            self.client.data['user_angle'] = angle
-            self.client.data['user_throttle'] = throttle
-            self.client.data['user_brake'] = brake
-            data = json.dumps(self.client.data)
-            angle_p, throttle_p, brake_p = self.brain.predict(self.client.img, self.client.data['speed'], self.client.data['accel_x'], self.client.data['accel_y'], self.client.data['accel_z'], self.client.data['gyro_x'], self.client.data['gyro_y'], self.client.data['gyro_z'])#
+        self.stamp(self.client.frames.get_version(), "send")
+        self.stats.control(angle, throttle, brake)
+        if not record or self.brain is None:
+            return
+        version, img, telemetry, raw = self.client.get_telemetry_frame()
+        if img is None:
+            return
+        if self.shadow is not None:
+            # the prediction is done by the worker of the shadow
+            self.shadow.submit(version, img, telemetry, raw, angle, throttle, brake)
+        else:
+            angle_p, throttle_p, brake_p = self.brain.predict(img, telemetry.speed, telemetry.accel_x, telemetry.accel_y, telemetry.accel_z, telemetry.gyro_x, telemetry.gyro_y, telemetry.gyro_z)#
             if abs(angle - angle_p) > 0.1:
-                print(self.data_manager.sample_count)
-                self.data_manager.append_sample(data)
+                self.data_manager.append_raw_sample(raw, angle, throttle, brake)
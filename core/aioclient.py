@@ -0,0 +1,147 @@
+"""
+AsyncClient
+
+asyncio version of the Client : several cars (connections to one or more
+sdsim servers) are driven by a single event loop, without one thread per car.
+The message API (send_scene, send_car_config, send_car_control, send_reset, ...)
+and the telemetry handling (telemetry, img, get_frame) are the same as Client.
+"""
+import asyncio
+import logging
+from time import perf_counter
+
+from .client import Client
+from .framer import MessageFramer
+from .sender import encode_control
+
+logger = logging.getLogger(__name__)
+
+class AsyncClient(Client):
+    """
+    Client running on an asyncio event loop
+
+    Usage :
+    ```
+        async def main():
+            clients = [AsyncClient(host, port, on_telemetry = drive) for _ in range(8)]
+            await asyncio.gather(*[c.start() for c in clients])
+            for c in clients:
+                c.send_scene("generated_track")
+            ...
+            await asyncio.gather(*[c.stop_async() for c in clients])
+    ```
+    """
+    def __init__(self, host, port, convert_json2img = True, float_notation = "auto", skip_unchanged_control = True, on_telemetry = None):
+        """
+        :param on_telemetry: function called with the client on each new telemetry
+        """
+        self.reader = None
+        self.writer = None
+        self.task = None
+        # messages sent before the connection is open
+        self.pending = []
+        self.last_control = None
+        self.on_telemetry = on_telemetry
+        super().__init__(host, port, convert_json2img = convert_json2img, float_notation = float_notation, skip_unchanged_control = skip_unchanged_control)
+
+    def connect(self):
+        """
+        The connection is opened by start() on the event loop
+        """
+        self.do_process_msgs = True
+        self.framer = MessageFramer()
+
+    async def start(self):
+        """
+        Open the connection and start the receive task
+        """
+        logger.info("connecting to %s:%d " % (self.host, self.port))
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        except ConnectionRefusedError as e:
+            raise(Exception("Could not connect to server. Is it running? : " + str(e)))
+        for data in self.pending:
+            self.writer.write(data)
+        self.pending = []
+        self.task = asyncio.ensure_future(self.proc_msg_async())
+
+    async def proc_msg_async(self):
+        """
+        Receive task, same role as Client.proc_msg
+        """
+        try:
+            while self.do_process_msgs:
+                data = await self.reader.read(1024 * 256)
+                if len(data) == 0:
+                    raise ConnectionError("socket closed by the server")
+                self.process_data(data, perf_counter())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print("Exception:", e)
+            self.aborted = True
+            self.on_msg_recv({"msg_type" : "aborted"})
+
+    def process_data(self, data, t_recv = None):
+        version = self.frames.get_version()
+        super().process_data(data, t_recv)
+        if self.on_telemetry is not None and self.frames.get_version() != version:
+            self.on_telemetry(self)
+
+    def write(self, data):
+        """
+        Write bytes on the connection (buffered by asyncio, so the order is kept)
+        """
+        if self.writer is None:
+            self.pending.append(data)
+        else:
+            self.writer.write(data)
+
+    def send(self, m):
+        self.write(m.encode("utf-8"))
+
+    def send_now(self, msg):
+        logger.debug("send_now:" + msg)
+        self.write(msg.encode("utf-8"))
+        # force the next control message (ex: after a reset)
+        self.last_control = None
+
+    def send_car_control(self, angle, throttle, brake):
+        """
+        Send car control (angle ou steering, throttle, brake)
+        """
+        data = encode_control(angle, throttle, brake)
+        if self.skip_unchanged_control and data == self.last_control:
+            return
+        self.last_control = data
+        self.write(data)
+
+    async def drain(self):
+        """
+        Wait until the write buffer is flushed
+        """
+        if self.writer is not None:
+            await self.writer.drain()
+
+    async def stop_async(self):
+        """
+        Stop the receive task and close the connection
+        """
+        self.do_process_msgs = False
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions = True)
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    def stop(self):
+        """
+        Stop from the event loop thread (use stop_async when possible)
+        """
+        asyncio.ensure_future(self.stop_async())
@@ -15,18 +15,28 @@ import sys
 import time
 import socket
 import select
+import selectors
 from threading import Thread
 import json
 import logging
 from datetime import datetime
 import json
-from PIL import Image
-import base64
-from io import BytesIO
-import copy
 import re
 
 from .camconf import CamConf
+from .framer import MessageFramer
+from .frame import FrameStore
+from .telemetry import Telemetry
+from .sender import OutboundChannel
+
+# Either the image value (skipped as a whole) or a numeric field followed by "," or "}"
+FLOAT_NOTATION_REGEX = re.compile(r'"image":"[^"]*"|(?P<key>"[a-zA-Z_]+":)(?P<num>[0-9,E-]+)(?=[,}])')
+
+def _replace_float_match(match):
+    num = match.group('num')
+    if num is None or ',' not in num:
+        return match.group(0)
+    return match.group('key') + num.replace(',', '.')
 
 def replace_float_notation(string):
     """
@@ -35,35 +45,53 @@ def replace_float_notation(string):
     This convert the json sent by Unity to a valid one.
     Ex: "test": 1,2, "key": 2 -> "test": 1.2, "key": 2
 
+    Only the numeric fields are rewritten, in a single pass,
+    and the image value is skipped.
+
     :param string: (str) The incorrect json string
     :return: (str) Valid JSON string
     """
-    regex_french_notation = r'"[a-zA-Z_]+":(?P<num>[0-9,E-]+),'
-    regex_end = r'"[a-zA-Z_]+":(?P<num>[0-9,E-]+)}'
-
-    for regex in [regex_french_notation, regex_end]:
-        matches = re.finditer(regex, string, re.MULTILINE)
-
-        for match in matches:
-            num = match.group('num').replace(',', '.')
-            string = string.replace(match.group('num'), num)
-    return string
+    return FLOAT_NOTATION_REGEX.sub(_replace_float_match, string)
 
 logger = logging.getLogger(__name__)
 
 class Client:
-    def __init__(self, host, port, poll_socket_sleep_time = 0.05, convert_json2img = False):
-        self.msg = None
+    def __init__(self, host, port, poll_socket_sleep_time = 0.05, convert_json2img = False, event_driven = False, select_timeout = 0.5, float_notation = "auto", control_rate = None, skip_unchanged_control = True, tracer = None, profiler = None):
+        """
+        :param poll_socket_sleep_time: sleep before each select in the polling loop (proc_msg)
+        :param convert_json2img: decode the image of each telemetry message
+        :param event_driven: use the event-driven loop (proc_msg_event) instead of the polling one
+        :param select_timeout: maximum time the event-driven loop waits for an event
+        :param float_notation: "dot" if the stream uses dot decimals (never normalized),
+                               "comma" if Unity uses comma decimals (always normalized),
+                               "auto" to normalize only once a message fails to parse
+        :param control_rate: maximum number of control messages sent per second,
+                             ex: the simulator frame rate (None : no limit)
+        :param skip_unchanged_control: do not send a control equal to the last one sent
+        :param tracer: LatencyTracer stamping each telemetry frame (None : no tracing)
+        :param profiler: SessionProfiler, checkpoint of the receive loop (None : no profiling)
+        """
         self.host = host
         self.port = port
         self.poll_socket_sleep_sec = poll_socket_sleep_time
+        self.event_driven = event_driven
+        self.select_timeout = select_timeout
+        self.float_notation = float_notation
+        self.control_rate = control_rate
+        self.skip_unchanged_control = skip_unchanged_control
+        self.channel = None
         self.th = None
+        self.framer = None
+        self.wakeup_r = None
+        self.wakeup_w = None
 
         self.current_cam_conf = None
 
-        self.data = None
         self.convert_json2img = convert_json2img
-        self.img = None
+        self.frames = FrameStore()
+        self.tracer = tracer
+        self.frames.tracer = tracer
+        self.profiler = profiler
 
         # the aborted flag will be set when we have detected a problem with the socket
         # that we can't recover from.
@@ -79,17 +107,85 @@ class Client:
             self.s.connect((self.host, self.port))
         except ConnectionRefusedError as e:
             raise(Exception("Could not connect to server. Is it running? If you specified 'remote', then you must start it manually. : " + str(e)))
+        # the controls are small messages : without this, Nagle holds each one
+        # until the ack of the previous one (piggybacked on the next telemetry)
+        self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         # time.sleep(pause_on_create)
         self.do_process_msgs = True
-        self.th = Thread(target=self.proc_msg, args=(self.s,))
+        self.framer = MessageFramer()
+        # all the messages are written to the socket by the channel thread
+        self.channel = OutboundChannel(self.s, control_rate = self.control_rate, skip_unchanged = self.skip_unchanged_control)
+        if self.event_driven:
+            # socket pair used to wake up the selector on stop
+            self.wakeup_r, self.wakeup_w = socket.socketpair()
+            self.wakeup_r.setblocking(0)
+            self.wakeup_w.setblocking(0)
+            self.th = Thread(target=self.proc_msg_event, args=(self.s,), name="client")
+        else:
+            self.th = Thread(target=self.proc_msg, args=(self.s,), name="client")
         self.th.start()
 
+    def wakeup(self):
+        """
+        Wake up the event-driven loop (no-op in polling mode)
+        """
+        if self.wakeup_w is not None:
+            try:
+                self.wakeup_w.send(b"\0")
+            except OSError:
+                # buffer full : the loop has already a pending wake up
+                pass
+
+    @property
+    def img(self):
+        """
+        Current image captured by the camera (read-only numpy array or None)
+        The image is decoded the first time it is read
+        """
+        return self.frames.get()[1]
+
+    @property
+    def telemetry(self):
+        """
+        Telemetry record of the last telemetry message (None if none)
+        """
+        return self.frames.get_telemetry()[1]
+
     def get_img(self):
         """
-        Get deep copy of the current image captured by the camera
+        Get the current image captured by the camera
+        The array is read-only, so it can be kept without copy
         """
-        return copy.deepcopy(self.img)
+        return self.img
+
+    def get_frame(self):
+        """
+        Get the current image with its version
+        :return: (version, image)
+        """
+        return self.frames.get()
+
+    def get_telemetry_frame(self):
+        """
+        Get the current image with the Telemetry and the json bytes of the same message
+        :return: (version, image, Telemetry, bytes), None for each before the first telemetry
+        """
+        return self.frames.get_telemetry_frame()
+
+    def get_telemetry(self):
+        """
+        Get the Telemetry and the json bytes of the current message, without decoding the image
+        :return: (version, Telemetry, bytes), None for each before the first telemetry
+        """
+        return self.frames.get_telemetry()
+
+    def wait_frame(self, version, timeout = None):
+        """
+        Wait for a frame newer than version (see FrameStore.wait)
+        :return: version of the current frame
+        """
+        return self.frames.wait(version, timeout)
 
     def set_cam_conf(self, cam_conf):
         """
@@ -100,16 +196,6 @@ class Client:
         self.current_cam_conf = cam_conf
         self.send_now(self.current_cam_conf.conf_json)
 
-    def flush_msg(self, writable):
-        """
-        Flush buffer and send all to the server
-        """
-        for s in writable:
-            if self.msg != None:
-                logger.debug("sending " + self.msg)
-                s.sendall(self.msg.encode("utf-8"))
-                self.msg = None
-
     def send_car_config(self, body_style, body_r, body_g, body_b, car_name, font_size):
         """
         Send car config (visual details)
@@ -144,13 +230,9 @@ class Client:
     def send_car_control(self, angle, throttle, brake):
         """
         Send car control (angle ou steering, throttle, brake)
+        Only the latest control is sent if several are pending
         """
-        d = dict()
-        d["msg_type"] = "control"
-        d["steering"] = str(angle)
-        d["throttle"] = str(throttle)
-        d["brake"] = str(brake)
-        self.send_now(json.dumps(d))
+        self.channel.put_control(angle, throttle, brake)
 
     def send_exit_scene(self):
         """
@@ -178,16 +260,15 @@ class Client:
 
     def send(self, m):
         """
-        Add message to send  (without sending)
+        Add message to send  (sent in order by the channel thread)
         """
-        self.msg = m
+        self.channel.put(m)
 
     def send_now(self, msg):
         """
-        Send all buffer message
+        Send message (in order with the previous ones)
         """
-        logger.debug("send_now:" + msg)
-        self.s.sendall(msg.encode("utf-8"))
+        self.channel.put(msg)
 
     def on_msg_recv(self, j):
         logger.debug("got:" + j['msg_type'])
@@ -196,80 +277,53 @@ class Client:
         # signal proc_msg loop to stop, then wait for thread to finish
         # close socket
         self.do_process_msgs = False
+        self.wakeup()
         if self.th is not None:
             self.th.join()
+        if self.channel is not None:
+            self.channel.stop()
         if self.s is not None:
             self.s.close()
+        if self.wakeup_r is not None:
+            self.wakeup_r.close()
+            self.wakeup_w.close()
+            self.wakeup_r = None
+            self.wakeup_w = None
 
 
     def proc_msg(self, sock):
         '''
         This is the thread message loop to process messages.
-        We will send any message that is queued via the self.msg variable
-        when our socket is in a writable state. 
-        And we will read any messages when it's in a readable state and then
+        We will read any messages when it's in a readable state and then
         call self.on_msg_recv with the json object message.
+        Outbound messages are written by self.channel.
         '''
         sock.setblocking(0)
         inputs = [ sock ]
-        outputs = [ sock ]
-        localbuffer=""
+        outputs = []
 
         while self.do_process_msgs:
             # without this sleep, I was getting very consistent socket errors
             # on Windows. Perhaps we don't need this sleep on other platforms.
             #time.sleep(0.1)
             time.sleep(self.poll_socket_sleep_sec)
+            if self.profiler is not None:
+                self.profiler.checkpoint()
             try:
-                # test our socket for readable, writable states.
-                readable, writable, exceptional = select.select(inputs, outputs, inputs)
+                # test our socket for readable state.
+                readable, writable, exceptional = select.select(inputs, outputs, inputs, self.select_timeout)
 
                 for s in readable:
                     try:
                         data = s.recv(1024 * 256)
+                        t_recv = time.perf_counter()
                     except ConnectionAbortedError:
                         logger.warn("socket connection aborted")
                         print("socket connection aborted")
                         self.do_process_msgs = False
                         break
 
-                    # we don't technically need to convert from bytes to string
-                    # for json.loads, but we do need a string in order to do
-                    # the split by \n newline char. This seperates each json msg.
-                    data = data.decode("utf-8")
-
-                    localbuffer += data
-
-                    n0=localbuffer.find("{")
-                    n1=localbuffer.rfind("}")
-                    if  n1>=0 and n0>=0 and n0<n1 :  # there is at least one message :
-                        msgs=localbuffer[n0:n1+1].split("\n")
-                        localbuffer=localbuffer[n1:]
-                        j = None
-                        for m in msgs:
-                              if len(m) <= 2:
-                                  continue
-                              # Replace comma with dots for floats
-                              # useful when using unity in a language different from English
-                              m = replace_float_notation(m)
-                              try:
-
-                                    j = json.loads(m)
-                              except Exception as e:
-                                    logger.error("Exception:" + str(e))
-                                    logger.error("json: " + m)
-                                    continue
-
-                              if 'msg_type' not in j:
-                                    logger.error('Warning expected msg_type field')
-                                    logger.error("json: " + m)
-                                    continue
-                              else : 
-                                    self.on_msg_recv(j)
-                        if j is not None and self.convert_json2img and j['msg_type'] == "telemetry":
-                            self.img = Image.open(BytesIO(base64.b64decode(j['image'])))
-                            self.data = j
-                self.flush_msg(writable)
+                    self.process_data(data, t_recv)
                 if len(exceptional) > 0:
                     logger.error("problems w sockets!")
 
@@ -278,4 +332,112 @@ class Client:
                 self.aborted = True
                 self.on_msg_recv({"msg_type" : "aborted"})
                 break
-    
\ No newline at end of file
+
+    def proc_msg_event(self, sock):
+        '''
+        Event-driven version of proc_msg.
+        Instead of sleeping before each select, we block on a selector until
+        the socket is readable, so the telemetry is handled as soon as it
+        arrives. The wake up socket pair interrupts the wait on stop and
+        select_timeout bounds the wait to check do_process_msgs.
+        '''
+        sock.setblocking(0)
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        selector.register(self.wakeup_r, selectors.EVENT_READ)
+
+        while self.do_process_msgs:
+            if self.profiler is not None:
+                self.profiler.checkpoint()
+            try:
+                events = selector.select(self.select_timeout)
+
+                for key, mask in events:
+                    if key.fileobj is self.wakeup_r:
+                        # drain all pending wake up bytes
+                        try:
+                            while self.wakeup_r.recv(1024):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    try:
+                        data = sock.recv(1024 * 256)
+                        t_recv = time.perf_counter()
+                    except BlockingIOError:
+                        continue
+                    except ConnectionAbortedError:
+                        logger.warning("socket connection aborted")
+                        print("socket connection aborted")
+                        self.do_process_msgs = False
+                        break
+
+                    if len(data) == 0:
+                        raise ConnectionError("socket closed by the server")
+
+                    self.process_data(data, t_recv)
+
+            except Exception as e:
+                print("Exception:", e)
+                self.aborted = True
+                self.on_msg_recv({"msg_type" : "aborted"})
+                break
+        selector.close()
+
+    def parse_msg(self, m):
+        '''
+        Parse a json message (bytes) according to self.float_notation
+        :return: (decoded json, valid json bytes)
+        '''
+        if self.float_notation == "dot":
+            return json.loads(m), m
+        if self.float_notation == "auto":
+            try:
+                return json.loads(m), m
+            except ValueError:
+                # a message still invalid once normalized raises here and keeps "auto"
+                j, m = self.parse_msg_comma(m)
+                # Unity sends comma decimals : normalize all the next messages
+                self.float_notation = "comma"
+                logger.info("comma float notation detected")
+                return j, m
+        return self.parse_msg_comma(m)
+
+    def parse_msg_comma(self, m):
+        '''
+        Parse a json message (bytes) with comma decimals
+        :return: (decoded json, valid json bytes)
+        '''
+        # Replace comma with dots for floats
+        # useful when using unity in a language different from English
+        m = replace_float_notation(m.decode("utf-8")).encode("utf-8")
+        return json.loads(m), m
+
+    def process_data(self, data, t_recv = None):
+        '''
+        Feed the received bytes to the framer and call self.on_msg_recv
+        for each complete json message.
+        :param t_recv: time.perf_counter() at the reception of data (for the tracer)
+        '''
+        j = None
+        raw = None
+        for m in self.framer.feed(data):
+            try:
+                j, raw = self.parse_msg(m)
+            except Exception as e:
+                logger.error("Exception:" + str(e))
+                logger.error("json: " + m.decode("utf-8", "replace"))
+                continue
+
+            if 'msg_type' not in j:
+                logger.error('Warning expected msg_type field')
+                logger.error("json: " + m.decode("utf-8", "replace"))
+                continue
+            else :
+                self.on_msg_recv(j)
+        if j is not None and self.convert_json2img and j['msg_type'] == "telemetry":
+            # only the client thread publishes, so the next version is known here
+            if self.tracer is not None:
+                self.tracer.begin(self.frames.get_version() + 1, t_recv or time.perf_counter(), time.perf_counter())
+            # the image is kept only in raw (see FrameStore)
+            self.frames.publish(raw, Telemetry.from_json(j))
@@ -0,0 +1,135 @@
+"""
+FrameStore
+
+Hand over the camera frames from the client thread to the consumers
+(controller, brain, display, recorder) without decoding or copying them more than once.
+"""
+import base64
+from io import BytesIO
+from threading import Lock, Condition
+import numpy as np
+from PIL import Image
+
+def decode_image(encoded):
+    """
+    Decode a base64 image (as sent in the telemetry) to a read-only numpy array
+    :param encoded: (str|bytes) base64 image
+    :return: numpy uint8 array (h, w, d)
+    """
+    img = np.asarray(Image.open(BytesIO(base64.b64decode(encoded))), dtype=np.uint8)
+    img.setflags(write=False)
+    return img
+
+def image_field(raw):
+    """
+    Slice the base64 image out of the json bytes of a telemetry message (no json decoding)
+    An escaped "\\/" is left in the slice, base64.b64decode discards the "\\"
+    :param raw: json bytes of the telemetry message
+    :return: bytes of the base64 image
+    """
+    start = raw.index(b'"', raw.index(b'"image"') + 7) + 1
+    return raw[start:raw.index(b'"', start)]
+
+class FrameStore:
+    """
+    Double buffer between the receive thread and the consumers
+
+    The receive thread only publishes the json bytes of the telemetry message
+    with its Telemetry record (no decoding of the image), the image is sliced
+    out of these bytes and decoded the first time a consumer asks for it.
+    Decoded frames are read-only numpy arrays, so the same array
+    can be shared by all the readers without copy.
+    Each published message has a version (incremented at each publish),
+    the frame, the Telemetry and the bytes of a version are always read together.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        # notified on each publish
+        self.cond = Condition(self.lock)
+        self.version = 0
+        # back buffer : json bytes and Telemetry of the last message published by the client
+        self.raw = None
+        self.telemetry = None
+        # front buffer : last decoded frame and its version
+        self.frame = None
+        self.frame_version = 0
+        # LatencyTracer stamping the decoding (optional)
+        self.tracer = None
+
+    def publish(self, raw, telemetry):
+        """
+        Publish a new telemetry message (called by the client thread)
+        :param raw: json bytes of the telemetry message (with its base64 image)
+        :param telemetry: Telemetry record of the message, its version is set here
+        :return: version of the frame
+        """
+        with self.lock:
+            self.version += 1
+            telemetry.version = self.version
+            self.raw = raw
+            self.telemetry = telemetry
+            self.cond.notify_all()
+            return self.version
+
+    def get(self):
+        """
+        Get the last frame, decoded if needed
+        :return: (version, numpy array or None)
+        """
+        return self.get_telemetry_frame()[:2]
+
+    def get_telemetry_frame(self):
+        """
+        Get the last frame, decoded if needed, with the Telemetry and the json bytes of the same message
+        :return: (version, numpy array or None, Telemetry or None, bytes or None)
+        """
+        with self.lock:
+            version, telemetry, raw = self.version, self.telemetry, self.raw
+            if self.frame_version == version:
+                return version, self.frame, telemetry, raw
+        frame = decode_image(image_field(raw))
+        if self.tracer is not None:
+            self.tracer.stamp(version, "decode")
+        with self.lock:
+            # another reader may have decoded a newer frame in the meantime
+            if version > self.frame_version:
+                self.frame = frame
+                self.frame_version = version
+        return version, frame, telemetry, raw
+
+    def get_telemetry(self):
+        """
+        Get the Telemetry and the json bytes of the last message, without decoding the frame
+        :return: (version, Telemetry or None, bytes or None)
+        """
+        with self.lock:
+            return self.version, self.telemetry, self.raw
+
+    def wait(self, version, timeout = None):
+        """
+        Wait for a frame different from version
+        :param version: version of the last frame processed by the caller
+        :param timeout: maximum wait in seconds (None : no limit)
+        :return: version of the last frame (equal to version on timeout)
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def get_version(self):
+        """
+        Version of the last published frame (0 if none)
+        """
+        return self.version
+
+    def clear(self):
+        """
+        Forget all the frames
+        """
+        with self.lock:
+            self.version = 0
+            self.raw = None
+            self.telemetry = None
+            self.frame = None
+            self.frame_version = 0
+            self.cond.notify_all()
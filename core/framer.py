@@ -0,0 +1,112 @@
+"""
+MessageFramer
+
+Incremental framer for the json-lines stream sent by the sdsim simulator.
+Received bytes are appended to a bytearray and split on newlines without
+decoding them and without rescanning the data already consumed.
+"""
+import re
+
+# json string (with its escaped characters), removed before counting the braces
+STRING_RE = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+class MessageFramer:
+    """
+    Split a byte stream into messages
+
+    Usage :
+    ```
+        framer = MessageFramer()
+        for msg in framer.feed(sock.recv(1024 * 256)):
+            j = json.loads(msg)
+    ```
+    """
+    def __init__(self, delimiter = b"\n", eager_close = True, max_size = 16 * 1024 * 1024):
+        """
+        :param delimiter: byte separating two messages
+        :param eager_close: also hand back a pending message ending with "}" without
+                            waiting for its delimiter (the simulator may not send it),
+                            only when its braces are balanced outside the strings
+        :param max_size: maximum size of a pending message, the buffer is dropped above
+        """
+        self.delimiter = delimiter
+        self.eager_close = eager_close
+        self.max_size = max_size
+        self.buffer = bytearray()
+        # position from which the pending data has not been scanned yet
+        self.scan_pos = 0
+        self.dropped = 0
+
+    def feed(self, data):
+        """
+        Append data to the buffer and return the list of complete messages
+        :param data: bytes received from the socket
+        :return: list of bytes (one per message, without delimiter)
+        """
+        buffer = self.buffer
+        buffer += data
+        msgs = []
+        start = 0
+        pos = buffer.find(self.delimiter, self.scan_pos)
+        while pos != -1:
+            self._append(msgs, start, pos)
+            start = pos + 1
+            pos = buffer.find(self.delimiter, start)
+
+        if self.eager_close and start < len(buffer) and buffer[-1] == 0x7d and self._is_closed(start): # "}"
+            self._append(msgs, start, len(buffer))
+            start = len(buffer)
+
+        if start > 0:
+            del buffer[:start]
+        self.scan_pos = len(buffer)
+
+        if len(buffer) > self.max_size:
+            self.dropped += 1
+            self.reset()
+        return msgs
+
+    def _append(self, msgs, start, end):
+        """
+        Append buffer[start:end] to msgs, ignoring blank messages
+        """
+        # skip garbage before the beginning of the json object
+        n0 = self.buffer.find(b"{", start, end)
+        if n0 != -1:
+            msgs.append(bytes(memoryview(self.buffer)[n0:end]).rstrip())
+
+    def _is_closed(self, start):
+        """
+        True if buffer[start:] is a whole json object : its braces are balanced
+        outside the strings (a chunk may end on the "}" of an inner object)
+        """
+        n0 = self.buffer.find(b"{", start)
+        if n0 == -1:
+            return False
+        structure = STRING_RE.sub(b"", memoryview(self.buffer)[n0:])
+        if b'"' in structure:
+            # a string is not finished yet
+            return False
+        depth = 0
+        for i in range(len(structure)):
+            c = structure[i]
+            if c == 0x7b: # "{"
+                depth += 1
+            elif c == 0x7d: # "}"
+                depth -= 1
+                if depth == 0:
+                    return i == len(structure) - 1 or structure[i + 1:].strip() == b""
+        return False
+
+    def pending(self):
+        """
+        Number of bytes waiting for the end of their message
+        """
+        return len(self.buffer)
+
+    def reset(self):
+        """
+        Drop all pending data
+        """
+        self.buffer = bytearray()
+        self.scan_pos = 0
@@ -0,0 +1,232 @@
+"""
+Multiprocess pipeline
+
+Optional runtime where the receiving (socket, json parsing, image decoding),
+the inference and the recording run in separate processes, so they do not
+compete for the GIL of a single process.
+
+    receiver  : Client -> FrameRing (shared memory)
+    inference : FrameRing -> brain.predict -> control queue -> receiver -> socket
+    recorder  : FrameRing (telemetry message) + controls -> .eslr file
+
+The images never go through a queue (no pickling), only the small control
+tuples do. The processes are started with "spawn" (TensorFlow is not fork safe),
+so brain_factory must be a function importable by the child processes.
+
+Usage :
+```
+    def make_brain():
+        ...
+        return Brain(data_manager)
+
+    if __name__ == "__main__":
+        pipeline = Pipeline("127.0.0.1", 9091, make_brain, sample_path = "sample.eslr")
+        pipeline.start()
+        ...
+        pipeline.stop()
+```
+"""
+import queue
+import multiprocessing as mp
+from threading import Thread
+from time import time
+
+from .shm_ring import FrameRing
+
+COUNTERS = ("received", "rejected", "inferred", "skipped", "overwritten", "recorded")
+
+def receiver_worker(host, port, ring_config, control_queue, stop_event, counters, client_kwargs):
+    """
+    Receive the telemetry, decode the images and write them in the ring,
+    send the controls of the control queue
+    """
+    from .client import Client
+
+    ring = FrameRing(**ring_config)
+    client = Client(host, port, convert_json2img = True, event_driven = True, **client_kwargs)
+    th = Thread(target=control_loop, args=(client, control_queue, stop_event), daemon=True)
+    th.start()
+    version = 0
+    try:
+        while not stop_event.is_set() and not client.aborted:
+            if client.wait_frame(version, timeout = 0.1) == version:
+                continue
+            version, img, telemetry, raw = client.get_telemetry_frame()
+            if img is None or img.shape != ring.shape:
+                counters["rejected"].value += 1
+                continue
+            ring.write(img, telemetry, raw)
+            counters["received"].value += 1
+    finally:
+        ring.close()
+        client.stop()
+        th.join()
+        ring.release()
+
+def control_loop(client, control_queue, stop_event):
+    """
+    Thread of the receiver sending the messages of the other processes
+    item : ("control", angle, throttle, brake) or ("msg", json string)
+    """
+    while not stop_event.is_set():
+        try:
+            item = control_queue.get(timeout = 0.1)
+        except queue.Empty:
+            continue
+        if item[0] == "control":
+            client.send_car_control(*item[1:])
+        else:
+            client.send(item[1])
+
+def inference_worker(ring_config, brain_factory, control_queue, record_queue, stop_event, counters, ready_event):
+    """
+    Predict the control of the last frame of the ring
+    """
+    import numpy as np
+
+    brain = brain_factory()
+    ring = FrameRing(**ring_config)
+    img = np.empty(ring.shape, dtype=np.uint8)
+    ready_event.set()
+    version = 0
+    try:
+        while not stop_event.is_set():
+            new_version = ring.wait(version, timeout = 0.1)
+            if new_version == 0 and ring.is_closed():
+                break
+            if new_version == version:
+                continue
+            if version > 0:
+                # frames written while the brain was busy
+                counters["skipped"].value += max(0, new_version - version - 1)
+            version = new_version
+            frame = ring.read(version, img)
+            if frame is None:
+                counters["overwritten"].value += 1
+                continue
+            telemetry = frame[1]
+            angle, throttle, brake = brain.predict(img, *telemetry.speed_accel_gyro())
+            control_queue.put(("control", float(angle), float(throttle), float(brake)))
+            counters["inferred"].value += 1
+            if record_queue is not None:
+                record_queue.put((version, float(angle), float(throttle), float(brake)))
+    finally:
+        ring.release()
+
+def recorder_worker(ring_config, sample_path, record_queue, stop_event, counters, delay):
+    """
+    Append the telemetry messages of the ring with the controls of the record queue to sample_path
+    """
+    from .telemetry import write_raw_sample
+
+    ring = FrameRing(**ring_config)
+    last_time_save = 0
+    try:
+        with open(sample_path, "ab") as f:
+            while not stop_event.is_set():
+                try:
+                    version, angle, throttle, brake = record_queue.get(timeout = 0.1)
+                except queue.Empty:
+                    continue
+                t = time()
+                if t - last_time_save <= delay:
+                    continue
+                frame = ring.read(version, with_raw = True)
+                if frame is None or frame[2] is None:
+                    counters["overwritten"].value += 1
+                    continue
+                # a non-finite prediction is not recorded
+                if write_raw_sample(f, frame[2], angle, throttle, brake):
+                    counters["recorded"].value += 1
+                    last_time_save = t
+    finally:
+        ring.release()
+
+class Pipeline:
+    def __init__(self, host, port, brain_factory, shape = (120, 160, 3), slots = 8, sample_path = None, record_delay = 1/20, client_kwargs = None):
+        """
+        :param brain_factory: function without argument returning the brain (called in the inference process)
+        :param shape: shape of the images sent by the simulator
+        :param slots: number of frames kept in the ring
+        :param sample_path: .eslr file where the frames and the predicted controls are recorded (None : no recorder)
+        :param record_delay: minimum delay between two recorded frames
+        :param client_kwargs: other arguments of the Client (ex: control_rate)
+        """
+        self.host = host
+        self.port = port
+        self.brain_factory = brain_factory
+        self.shape = shape
+        self.slots = slots
+        self.sample_path = sample_path
+        self.record_delay = record_delay
+        self.client_kwargs = client_kwargs or {}
+
+        self.ctx = mp.get_context("spawn")
+        self.ring = None
+        self.processes = []
+        self.control_queue = None
+        self.stop_event = None
+        self.ready_event = None
+        self.counters = None
+
+    def start(self, timeout = 120):
+        """
+        Start the processes and wait for the brain to be loaded
+        :param timeout: maximum wait for the brain
+        :return: True if the brain is ready
+        """
+        ctx = self.ctx
+        self.ring = FrameRing(shape = self.shape, slots = self.slots)
+        ring_config = self.ring.config()
+        self.control_queue = ctx.Queue()
+        record_queue = ctx.Queue() if self.sample_path is not None else None
+        self.stop_event = ctx.Event()
+        self.ready_event = ctx.Event()
+        self.counters = {name : ctx.Value("q", 0) for name in COUNTERS}
+
+        self.processes = [
+            ctx.Process(target=inference_worker, name="inference", daemon=True,
+                        args=(ring_config, self.brain_factory, self.control_queue, record_queue, self.stop_event, self.counters, self.ready_event)),
+        ]
+        if record_queue is not None:
+            self.processes.append(ctx.Process(target=recorder_worker, name="recorder", daemon=True,
+                                              args=(ring_config, self.sample_path, record_queue, self.stop_event, self.counters, self.record_delay)))
+        for process in self.processes:
+            process.start()
+        # the receiver is started when the brain is ready, so the first frames are not all skipped
+        ready = self.ready_event.wait(timeout)
+        if not ready:
+            print("[ERROR] Pipeline : the brain is not ready after", timeout, "s")
+        receiver = ctx.Process(target=receiver_worker, name="receiver", daemon=True,
+                               args=(self.host, self.port, ring_config, self.control_queue, self.stop_event, self.counters, self.client_kwargs))
+        receiver.start()
+        self.processes.append(receiver)
+        print("[INFO] Pipeline started :", ", ".join(p.name + " (pid " + str(p.pid) + ")" for p in self.processes))
+        return ready
+
+    def send(self, msg):
+        """
+        Send a json message to the simulator (ex: reset_car), in order with the controls
+        """
+        self.control_queue.put(("msg", msg))
+
+    def stats(self):
+        """
+        :return: dict counter name -> value
+        """
+        return {name : value.value for name, value in self.counters.items()}
+
+    def stop(self, timeout = 5):
+        if self.stop_event is None:
+            return
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                print("[WARNING] Pipeline :", process.name, "does not stop, killed")
+                process.kill()
+                process.join()
+        self.processes = []
+        self.ring.release()
+        self.ring = None
+        self.stop_event = None
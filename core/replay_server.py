@@ -0,0 +1,271 @@
+"""
+ReplayServer
+
+Local stand-in for the sdsim simulator, speaking the same json protocol
+as the Unity server. The telemetry of an existing .eslr recording (or a
+synthetic one) is replayed at a fixed rate to each connected client, and
+every message received (control, reset_car, load_scene, cam_config, ...)
+is recorded, so the whole driving loop can be measured without Unity.
+"""
+import os
+import json
+import zlib
+import struct
+import base64
+import socket
+import logging
+from threading import Thread, Lock
+from time import time, sleep
+
+logger = logging.getLogger(__name__)
+
+# Fields added by the recorder, not sent by the simulator
+RECORD_FIELDS = ("user_angle", "user_throttle", "user_brake")
+
+def load_eslr_frames(eslr_path, max_frames = None):
+    """
+    Read the telemetry lines of an .eslr file
+    :return: list of bytes (one json message per frame, ended by a newline)
+    """
+    frames = []
+    with open(eslr_path, "r") as f:
+        for line in f:
+            data_line = json.loads(line)
+            if data_line.get("msg_type") != "telemetry":
+                continue
+            for k in RECORD_FIELDS:
+                data_line.pop(k, None)
+            frames.append((json.dumps(data_line) + "\n").encode("utf-8"))
+            if max_frames is not None and len(frames) >= max_frames:
+                break
+    return frames
+
+def make_png(width = 160, height = 120):
+    """
+    Encode a RGB gradient as PNG (without PIL)
+    :return: bytes
+    """
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    # each row starts with the filter type 0 (None)
+    raw = b"".join(b"\0" + b"".join(bytes((x * 255 // width, y * 255 // height, 128)) for x in range(width)) for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+def synthetic_frames(nbr_frame = 120, image = None):
+    """
+    Telemetry frames with a fixed image
+    :param image: base64 image (default : 160x120 PNG gradient)
+    :return: list of bytes
+    """
+    if image is None:
+        image = base64.b64encode(make_png()).decode("utf-8")
+    frames = []
+    for i in range(nbr_frame):
+        d = {"msg_type" : "telemetry", "steering_angle" : 0.0, "throttle" : 0.0, "speed" : 0.0, "image" : image,
+             "hit" : "none", "time" : 0.0, "accel_x" : 0.0, "accel_y" : 0.0, "accel_z" : 0.0,
+             "gyro_x" : 0.0, "gyro_y" : 0.0, "gyro_z" : 0.0, "activeNode" : i, "totalNodes" : nbr_frame}
+        frames.append((json.dumps(d) + "\n").encode("utf-8"))
+    return frames
+
+class ReplaySession:
+    """
+    One client connection : telemetry sent and messages received
+    """
+    def __init__(self, server, conn, address):
+        self.server = server
+        self.conn = conn
+        self.address = address
+        self.running = True
+        # time of each telemetry sent
+        self.sent_times = []
+        # (time, message) of each message received
+        self.received = []
+        self.lock = Lock()
+
+        self.th_send = Thread(target=self.send_loop, daemon=True)
+        self.th_recv = Thread(target=self.recv_loop, daemon=True)
+        self.th_send.start()
+        self.th_recv.start()
+
+    def write(self, data):
+        try:
+            self.conn.sendall(data)
+        except OSError:
+            self.running = False
+
+    def send_loop(self):
+        """
+        Send the frames at server.rate Hz
+        """
+        frames = self.server.frames
+        period = 1.0 / self.server.rate
+        i = 0
+        next_time = time()
+        while self.running and self.server.running:
+            if i >= len(frames):
+                if not self.server.loop:
+                    break
+                i = 0
+            t = time()
+            with self.lock:
+                self.sent_times.append(t)
+                self.write(frames[i])
+            i += 1
+            next_time += period
+            delay = next_time - time()
+            if delay > 0:
+                sleep(delay)
+            else:
+                # too late : do not try to catch up
+                next_time = time()
+
+    def recv_loop(self):
+        """
+        Decode the json messages sent by the client (not separated by newlines)
+        """
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while self.running and self.server.running:
+            try:
+                data = self.conn.recv(65536)
+            except OSError:
+                break
+            if len(data) == 0:
+                break
+            t = time()
+            buffer += data.decode("utf-8")
+            while True:
+                buffer = buffer.lstrip()
+                if len(buffer) == 0:
+                    break
+                try:
+                    msg, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    # message not complete
+                    break
+                buffer = buffer[end:]
+                self.handle(t, msg)
+        self.running = False
+
+    def handle(self, t, msg):
+        """
+        Record a message and answer it like the simulator
+        """
+        if self.server.record:
+            self.received.append((t, msg))
+        msg_type = msg.get("msg_type")
+        if msg_type == "load_scene":
+            with self.lock:
+                self.write(b'{"msg_type": "scene_loaded"}\n')
+        elif msg_type == "car_config" or msg_type == "cam_config":
+            logger.debug("config : " + json.dumps(msg))
+        elif msg_type == "exit_scene" or msg_type == "quit_app":
+            self.running = False
+
+    def control_stats(self):
+        """
+        Latency between each telemetry and the first control received after it
+        :return: (number of frames answered by a control, list of latencies in seconds)
+        """
+        controls = [t for t, msg in self.received if msg.get("msg_type") == "control"]
+        latencies = []
+        j = 0
+        sent_times = list(self.sent_times)
+        for i, t_sent in enumerate(sent_times):
+            t_next = sent_times[i + 1] if i + 1 < len(sent_times) else float("inf")
+            while j < len(controls) and controls[j] < t_sent:
+                j += 1
+            if j < len(controls) and controls[j] < t_next:
+                latencies.append(controls[j] - t_sent)
+        return len(latencies), latencies
+
+    def close(self):
+        self.running = False
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+class ReplayServer:
+    """
+    Fake sdsim server
+
+    Usage :
+    ```
+        server = ReplayServer(port = 9091, eslr_path = "sample.eslr", rate = 20)
+        server.start()
+        client = Client("127.0.0.1", server.port, convert_json2img = True)
+        ...
+        server.stop()
+    ```
+    """
+    def __init__(self, host = "127.0.0.1", port = 9091, eslr_path = None, rate = 20, loop = True, record = True, max_frames = None):
+        """
+        :param port: port to listen (0 : any free port, see self.port after start)
+        :param eslr_path: recording to replay (None : synthetic telemetry)
+        :param rate: telemetry frames sent per second
+        :param loop: restart from the first frame at the end of the recording
+        :param record: keep all the messages received
+        """
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.loop = loop
+        self.record = record
+        if eslr_path is not None:
+            self.frames = load_eslr_frames(eslr_path, max_frames = max_frames)
+        else:
+            self.frames = synthetic_frames()
+        if len(self.frames) == 0:
+            raise Exception("No telemetry to replay in " + str(eslr_path))
+
+        self.sessions = []
+        self.running = False
+        self.s = None
+        self.th = None
+
+    def start(self):
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.s.bind((self.host, self.port))
+        self.port = self.s.getsockname()[1]
+        self.s.listen()
+        self.running = True
+        self.th = Thread(target=self.accept_loop, daemon=True)
+        self.th.start()
+        logger.info("replay server listening on %s:%d" % (self.host, self.port))
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                conn, address = self.s.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sessions.append(ReplaySession(self, conn, address))
+
+    def received(self, msg_type = None):
+        """
+        All the messages received by all the sessions
+        :param msg_type: keep only this type of message
+        :return: list of (time, message)
+        """
+        msgs = []
+        for session in self.sessions:
+            msgs += [(t, m) for t, m in session.received if msg_type is None or m.get("msg_type") == msg_type]
+        return msgs
+
+    def stop(self):
+        self.running = False
+        if self.s is not None:
+            try:
+                self.s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.s.close()
+        for session in self.sessions:
+            session.close()
+        if self.th is not None:
+            self.th.join()
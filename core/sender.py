@@ -0,0 +1,158 @@
+"""
+OutboundChannel
+
+Single writer of the client socket.
+Messages like load_scene, car_config or reset_car are sent in order,
+control messages are coalesced (only the latest is sent) and optionally
+rate limited.
+"""
+import select
+import logging
+from collections import deque
+from threading import Thread, Condition
+from time import time
+
+logger = logging.getLogger(__name__)
+
+CONTROL_TEMPLATE = '{"msg_type": "control", "steering": "%s", "throttle": "%s", "brake": "%s"}'
+
+def encode_control(angle, throttle, brake):
+    """
+    Fast serializer of the control message
+    Same output as json.dumps of the control dict (values sent as str)
+    :return: bytes
+    """
+    return (CONTROL_TEMPLATE % (angle, throttle, brake)).encode("utf-8")
+
+class OutboundChannel:
+    """
+    Queue of outbound messages written to the socket by a dedicated thread
+    """
+    def __init__(self, sock, control_rate = None, skip_unchanged = True):
+        """
+        :param sock: connected socket
+        :param control_rate: maximum number of control messages per second (None : no limit)
+        :param skip_unchanged: do not send a control message equal to the last one sent
+        """
+        self.sock = sock
+        self.min_interval = 1.0 / control_rate if control_rate else 0.0
+        self.skip_unchanged = skip_unchanged
+
+        self.cond = Condition()
+        self.queue = deque()
+        self.control = None
+        self.last_control = None
+        self.last_control_time = 0.0
+        self.running = True
+        # after stop(), the pending messages are dropped when this time is passed
+        self.stop_deadline = None
+
+        # counters
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+        self.th = Thread(target=self.loop, daemon=True)
+        self.th.start()
+
+    def put(self, msg):
+        """
+        Queue a message, sent after all the previous ones
+        :param msg: json string
+        """
+        logger.debug("send_now:" + msg)
+        data = msg.encode("utf-8")
+        with self.cond:
+            # keep the order with a control message sent before
+            if self.control is not None:
+                self.queue.append(self.control)
+                self.control = None
+            self.queue.append(data)
+            # force the next control message (ex: after a reset)
+            self.last_control = None
+            self.cond.notify()
+
+    def put_control(self, angle, throttle, brake):
+        """
+        Set the control message to send, replacing the pending one
+        """
+        data = encode_control(angle, throttle, brake)
+        with self.cond:
+            if self.control is not None:
+                self.coalesced += 1
+            elif self.skip_unchanged and data == self.last_control:
+                self.skipped += 1
+                return
+            self.control = data
+            self.cond.notify()
+
+    def next_message(self):
+        """
+        Pop the next message ready to be sent (lock held)
+        :return: (bytes or None, time to wait before the pending control or None)
+        """
+        if self.queue:
+            return self.queue.popleft(), None
+        if self.control is not None:
+            t = time()
+            delay = self.last_control_time + self.min_interval - t
+            if delay > 0:
+                return None, delay
+            data = self.control
+            self.control = None
+            self.last_control = data
+            self.last_control_time = t
+            return data, None
+        return None, None
+
+    def loop(self):
+        """
+        Writer thread
+        """
+        while True:
+            with self.cond:
+                data, delay = self.next_message()
+                while data is None:
+                    if not self.running:
+                        return
+                    self.cond.wait(delay)
+                    data, delay = self.next_message()
+            try:
+                self.write(data)
+                self.sent += 1
+            except OSError as e:
+                logger.error("outbound channel : " + str(e))
+                with self.cond:
+                    self.running = False
+                    self.queue.clear()
+                    self.control = None
+                return
+
+    def write(self, data):
+        """
+        Send all the data (the socket may be non blocking)
+        Raise TimeoutError if the socket is still full at the deadline of stop()
+        (ex: the simulator does not read any more)
+        """
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                n = self.sock.send(view)
+                view = view[n:]
+            except BlockingIOError:
+                if self.stop_deadline is not None and time() > self.stop_deadline:
+                    raise TimeoutError("socket full, " + str(len(view)) + " bytes not sent")
+                select.select([], [self.sock], [], 0.1)
+
+    def stop(self, timeout = 2.0):
+        """
+        Send the pending messages then stop the writer thread
+        :param timeout: maximum time to send the pending messages, they are dropped after
+        """
+        with self.cond:
+            self.stop_deadline = time() + timeout
+            self.running = False
+            self.cond.notify()
+        self.th.join(timeout + 1)
+        if self.th.is_alive():
+            logger.error("outbound channel : writer thread not stopped")
@@ -0,0 +1,163 @@
+"""
+FrameRing
+
+Ring buffer of frames in shared memory (multiprocessing.shared_memory) to hand
+over the camera frames between processes without pickling them.
+Each slot holds a fixed-shape uint8 image, a telemetry row (TELEMETRY_FIELDS
+as float64) and the wire bytes of the telemetry message (for the recorder).
+
+One process writes (the receiver), any number of processes read.
+Each slot has a sequence number, odd while the slot is written, so a reader
+detects a frame overwritten during its read (seqlock).
+"""
+from multiprocessing import shared_memory
+from time import sleep, perf_counter
+import numpy as np
+
+from .telemetry import Telemetry, TELEMETRY_FIELDS
+
+# header : last version written, closed flag
+HEADER_SIZE = 2
+
+class FrameRing:
+    def __init__(self, shape = (120, 160, 3), slots = 8, max_raw = 256 * 1024, name = None):
+        """
+        :param shape: shape of the images (h, w, d)
+        :param slots: number of frames kept
+        :param max_raw: maximum size of the telemetry message kept by frame (0 : not kept)
+        :param name: name of an existing ring to attach (None : create a new one)
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.max_raw = max_raw
+        img_size = int(np.prod(self.shape))
+        row_size = len(TELEMETRY_FIELDS)
+        sizes = [
+            (HEADER_SIZE + 3 * slots) * 8,  # header + (sequence, version, raw length) by slot
+            slots * row_size * 8,           # telemetry rows
+            slots * img_size,               # images
+            slots * max_raw,                # telemetry messages
+        ]
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        buf = self.shm.buf
+        offset = 0
+        self.header = np.ndarray((HEADER_SIZE + 3 * slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += sizes[0]
+        self.rows = np.ndarray((slots, row_size), dtype=np.float64, buffer=buf, offset=offset)
+        offset += sizes[1]
+        self.images = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=offset)
+        offset += sizes[2]
+        self.raws = np.ndarray((slots, max_raw), dtype=np.uint8, buffer=buf, offset=offset)
+        self.sequences = self.header[HEADER_SIZE:HEADER_SIZE + slots]
+        self.versions = self.header[HEADER_SIZE + slots:HEADER_SIZE + 2 * slots]
+        self.raw_sizes = self.header[HEADER_SIZE + 2 * slots:]
+        if self.owner:
+            self.header[:] = 0
+
+    def config(self):
+        """
+        Arguments to attach the ring in another process : FrameRing(**ring.config())
+        """
+        return {"shape" : self.shape, "slots" : self.slots, "max_raw" : self.max_raw, "name" : self.name}
+
+    def write(self, img, telemetry, raw = None):
+        """
+        Write a new frame (only one writer)
+        :param img: uint8 array of shape self.shape
+        :param telemetry: Telemetry
+        :param raw: json bytes of the telemetry message (ignored if too long)
+        :return: version of the frame
+        """
+        version = int(self.header[0]) + 1
+        slot = version % self.slots
+        self.sequences[slot] += 1
+        self.images[slot] = img
+        row = self.rows[slot]
+        for i, field in enumerate(TELEMETRY_FIELDS):
+            value = getattr(telemetry, field)
+            row[i] = value if isinstance(value, (int, float)) else 0
+        if raw is not None and len(raw) <= self.max_raw:
+            self.raws[slot, :len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+            self.raw_sizes[slot] = len(raw)
+        else:
+            self.raw_sizes[slot] = 0
+        self.versions[slot] = version
+        self.sequences[slot] += 1
+        self.header[0] = version
+        return version
+
+    def get_version(self):
+        """
+        Version of the last frame written (0 if none)
+        """
+        return int(self.header[0])
+
+    def read(self, version, img = None, with_raw = False):
+        """
+        Copy a frame out of the ring
+        :param version: version of the frame (ex: get_version())
+        :param img: array of shape self.shape where the image is copied (None : new array)
+        :param with_raw: also copy the telemetry message
+        :return: (img, Telemetry, raw bytes or None), None if the frame has been overwritten
+        """
+        if version <= 0:
+            return None
+        slot = version % self.slots
+        sequence = int(self.sequences[slot])
+        if sequence % 2 == 1 or self.versions[slot] != version:
+            return None
+        if img is None:
+            img = np.empty(self.shape, dtype=np.uint8)
+        np.copyto(img, self.images[slot])
+        row = self.rows[slot].tolist()
+        raw = None
+        if with_raw:
+            size = int(self.raw_sizes[slot])
+            raw = self.raws[slot, :size].tobytes() if size > 0 else None
+        if int(self.sequences[slot]) != sequence:
+            # the writer has used the slot during the copy
+            return None
+        telemetry = Telemetry(**dict(zip(TELEMETRY_FIELDS, row)), version = version)
+        return img, telemetry, raw
+
+    def wait(self, version, timeout = None, poll_interval = 0.0005):
+        """
+        Wait for a frame newer than version (polling the header)
+        :param timeout: maximum wait in seconds (None : no limit)
+        :return: version of the last frame (equal to version on timeout), 0 when closed
+        """
+        deadline = None if timeout is None else perf_counter() + timeout
+        while True:
+            if self.header[1]:
+                return 0
+            current = int(self.header[0])
+            if current != version:
+                return current
+            if deadline is not None and perf_counter() >= deadline:
+                return current
+            sleep(poll_interval)
+
+    def close(self):
+        """
+        Mark the ring as closed (the readers stop waiting)
+        """
+        self.header[1] = 1
+
+    def is_closed(self):
+        return bool(self.header[1])
+
+    def release(self):
+        """
+        Detach the shared memory (and destroy it if this process created it)
+        """
+        self.header = self.rows = self.images = self.raws = None
+        self.sequences = self.versions = self.raw_sizes = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,83 @@
+"""
+Telemetry
+
+Compact record of the scalar fields of a telemetry message.
+The image is not kept in the record (see FrameStore).
+"""
+import math
+
+# Scalar fields sent by the sdsim simulator in the telemetry message
+TELEMETRY_FIELDS = ("steering_angle", "throttle", "speed", "hit", "time",
+                    "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z",
+                    "pos_x", "pos_y", "pos_z", "cte", "activeNode", "totalNodes")
+
+# Fields never stored in the record
+IGNORED_FIELDS = frozenset(("msg_type", "image"))
+KNOWN_FIELDS = IGNORED_FIELDS.union(TELEMETRY_FIELDS)
+
+def write_raw_sample(f, raw, user_angle, user_throttle, user_brake):
+    """
+    Write a telemetry message as received from the simulator as a line of an .eslr file,
+    only the user fields are added (no json decoding/encoding of the message)
+    :param f: file opened in binary mode
+    :param raw: json bytes of the telemetry message
+    :return: False if a user field is NaN or infinite (not valid json, nothing written)
+    """
+    user_values = (float(user_angle), float(user_throttle), float(user_brake))
+    if not all(math.isfinite(v) for v in user_values):
+        return False
+    # repr of a finite float is a valid json number
+    user_fields = ', "user_angle": %r, "user_throttle": %r, "user_brake": %r}\n' % user_values
+    # raw ends with the "}" of the json object
+    f.write(memoryview(raw)[:-1])
+    f.write(user_fields.encode("utf-8"))
+    return True
+
+class Telemetry:
+    """
+    Telemetry record with attribute access (telemetry.speed, telemetry.activeNode, ...)
+    Unknown fields are kept in the extra dict
+    """
+    __slots__ = TELEMETRY_FIELDS + ("extra", "version")
+
+    def __init__(self, **kwargs):
+        for field in TELEMETRY_FIELDS:
+            setattr(self, field, kwargs.pop(field, 0))
+        self.version = kwargs.pop("version", 0)
+        self.extra = kwargs
+
+    @classmethod
+    def from_json(cls, j, version = 0):
+        """
+        Build the record from a decoded telemetry message
+        :param j: dict given by json.loads
+        :param version: version of the frame published with this telemetry
+        :return: Telemetry
+        """
+        record = cls.__new__(cls)
+        get = j.get
+        for field in TELEMETRY_FIELDS:
+            setattr(record, field, get(field, 0))
+        record.version = version
+        record.extra = {k: v for k, v in j.items() if k not in KNOWN_FIELDS}
+        return record
+
+    def speed_accel_gyro(self):
+        """
+        Inputs of the brain other than the image
+        :return: (speed, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)
+        """
+        return (self.speed, self.accel_x, self.accel_y, self.accel_z, self.gyro_x, self.gyro_y, self.gyro_z)
+
+    def to_dict(self):
+        """
+        Convert the record to a telemetry dict (without image)
+        """
+        d = {"msg_type" : "telemetry"}
+        for field in TELEMETRY_FIELDS:
+            d[field] = getattr(self, field)
+        d.update(self.extra)
+        return d
+
+    def __repr__(self):
+        return "Telemetry(" + ", ".join(f + "=" + repr(getattr(self, f)) for f in TELEMETRY_FIELDS) + ")"
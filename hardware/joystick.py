@@ -2,6 +2,9 @@ import enum
 import pygame
 import pygame.display
 import os
+from collections import namedtuple
+from threading import Thread, Lock
+from time import time, sleep
 
 # To remove error "No device" in Visual Code
 os.environ["SDL_VIDEODRIVER"] = "dummy"
@@ -31,22 +34,88 @@ class Button(enum.Enum):
    TopDirection = 13
    DownDirection = 14
 
+# Immutable state of the joystick for one tick of the control loop
+# axes : tuple of raw axis values
+# buttons : tuple of button states
+# pressed : frozenset of the buttons pressed since the previous tick (edge)
+InputSnapshot = namedtuple("InputSnapshot", ["time", "axes", "buttons", "pressed"])
+
 class JoystickController:
-    def __init__(self, id_controller=0):
+    def __init__(self, id_controller=0, poll_rate = None):
+        """
+        :param id_controller: pygame joystick id
+        :param poll_rate: read the joystick in a background thread at this rate (Hz),
+                          None : read it on each tick() of the control loop
+        """
         pygame.init()
         pygame.display.init()
         pygame.joystick.init()
         self.id = id_controller
         self.refresh()
         self.controller.init()
+
+        self.lock = Lock()
+        self.axes = ()
+        self.buttons = ()
+        self.pending_pressed = set()
+        self.poll()
+        # buttons already held at start are not pressed
+        self.pending_pressed = set()
+        self.snapshot = InputSnapshot(time(), self.axes, self.buttons, frozenset())
+
+        self.running = True
+        self.th = None
+        if poll_rate is not None:
+            self.th = Thread(target=self.poll_loop, args=(1.0 / poll_rate,), daemon=True)
+            self.th.start()
     
     def refresh(self):
         pygame.event.get()
         self.controller = pygame.joystick.Joystick(self.id)
         self.controller.init()
 
+    def poll(self):
+        """
+        Read all the axes and buttons once
+        """
+        for event in pygame.event.get():
+            if event.type == pygame.JOYDEVICEADDED:
+                self.controller = pygame.joystick.Joystick(self.id)
+                self.controller.init()
+        axes = tuple(self.controller.get_axis(i) for i in range(self.controller.get_numaxes()))
+        buttons = tuple(self.controller.get_button(i) for i in range(self.controller.get_numbuttons()))
+        with self.lock:
+            for i, state in enumerate(buttons):
+                if state and (i >= len(self.buttons) or not self.buttons[i]):
+                    self.pending_pressed.add(i)
+            self.axes = axes
+            self.buttons = buttons
+
+    def poll_loop(self, period):
+        while self.running:
+            self.poll()
+            sleep(period)
+
+    def tick(self):
+        """
+        Capture the state of the joystick for this iteration of the control loop
+        All the get_* functions read this snapshot until the next tick
+        :return: InputSnapshot
+        """
+        if self.th is None:
+            self.poll()
+        with self.lock:
+            self.snapshot = InputSnapshot(time(), self.axes, self.buttons, frozenset(self.pending_pressed))
+            self.pending_pressed = set()
+        return self.snapshot
+
+    def stop(self):
+        self.running = False
+        if self.th is not None:
+            self.th.join()
+
     def get_axis(self, axis):
-        value = self.controller.get_axis(axis.value)
+        value = self.snapshot.axes[axis.value]
         if (axis in [Axis.LeftVertical, Axis.RightVertical, Axis.LeftHorizontal, Axis.LeftHorizontal]):
             value -= SHIFT_AXIS
         if (axis in [Axis.LeftVertical, Axis.RightVertical]):
@@ -60,8 +129,16 @@ class JoystickController:
         return -self.get_axis_positive(axis)
     
     def get_button(self, button):
-        self.refresh()
-        return self.controller.get_button(button.value)
+        """
+        State of the button in the current snapshot
+        """
+        return self.snapshot.buttons[button.value]
+
+    def get_button_pressed(self, button):
+        """
+        True only on the tick where the button has been pressed (not while it is held)
+        """
+        return button.value in self.snapshot.pressed
     
     ## Custome control to drive the car and more generaly controle the software ##
     ## Same for all hardware class ##
@@ -88,13 +165,17 @@ class JoystickController:
         return self.get_button(Button.LeftBack)
 
     def get_reset_controller(self):
-        return self.get_button(Button.Options)
+        return self.get_button_pressed(Button.Options)
     
     def get_train_controller(self):
-        return self.get_button(Button.Share)
+        return self.get_button_pressed(Button.Share)
 
     def get_exit_app_controller(self):
-        return self.get_button(Button.Home)
+        return self.get_button_pressed(Button.Home)
     
     def get_start_car(self):
-        return self.get_button(Button.RightBack)
\ No newline at end of file
+        return self.get_button(Button.RightBack)
+
+    def get_profile_controller(self):
+        # Triangle pressed while Square is held
+        return self.get_button(Button.Square) and self.get_button_pressed(Button.Triangle)
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import csv
+import json
+
+class ReplayController:
+    """
+    Replay the user inputs (user_angle, user_throttle, user_brake) of a recording,
+    one sample per frame (or per tick without client)
+    Same interface as JoystickController, the buttons are never pressed except
+    exit at the end of the recording (if loop is False)
+    """
+    def __init__(self, path, client = None, loop = False, rec = False):
+        """
+        :param path: .eslr recording or label.csv of an extracted recording
+        :param client: Client, the timeline advances with its frames (None : one sample per tick)
+        :param loop: restart at the beginning at the end of the recording
+        :param rec: hold the record button
+        """
+        self.timeline = ReplayController.load_timeline(path)
+        if len(self.timeline) == 0:
+            raise Exception("No user inputs found in " + path)
+        self.client = client
+        self.loop = loop
+        self.rec = rec
+
+        self.index = 0
+        self.ticks = 0
+        self.start_version = None
+        self.finished = False
+
+    @staticmethod
+    def load_timeline(path):
+        """
+        :return: list of (user_angle, user_throttle, user_brake)
+        """
+        timeline = []
+        if os.path.splitext(path)[1] == ".csv":
+            with open(path, "r") as f:
+                for row in csv.DictReader(f):
+                    timeline.append((float(row.get("user_angle", 0)), float(row.get("user_throttle", 0)), float(row.get("user_brake", 0))))
+        else:
+            with open(path, "r") as f:
+                for line in f:
+                    data_line = json.loads(line)
+                    if data_line.get("msg_type") == "telemetry":
+                        timeline.append((data_line.get("user_angle", 0), data_line.get("user_throttle", 0), data_line.get("user_brake", 0)))
+        return timeline
+
+    def elapsed(self):
+        """
+        Number of frames (or ticks) since the beginning
+        """
+        if self.client is None:
+            return self.ticks
+        version = self.client.frames.get_version()
+        if self.start_version is None:
+            self.start_version = version
+        return version - self.start_version
+
+    def tick(self):
+        self.ticks += 1
+        position = self.elapsed()
+        if position >= len(self.timeline) and not self.loop:
+            self.finished = True
+            self.index = len(self.timeline) - 1
+        else:
+            self.index = position % len(self.timeline)
+
+    def stop(self):
+        pass
+
+    ## Custome control to drive the car and more generaly controle the software ##
+    ## Same for all hardware class ##
+
+    def get_angle_controller(self):
+        return self.timeline[self.index][0]
+
+    def get_throttle_controller(self):
+        return self.timeline[self.index][1]
+
+    def get_brake_controller(self):
+        return self.timeline[self.index][2]
+
+    def get_rec_controller(self):
+        return self.rec and not self.finished
+
+    def get_autodrive_controller(self):
+        return False
+
+    def get_reset_controller(self):
+        return False
+
+    def get_train_controller(self):
+        return False
+
+    def get_exit_app_controller(self):
+        return self.finished
+
+    def get_start_car(self):
+        return False
+
+    def get_profile_controller(self):
+        return False
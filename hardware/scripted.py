@@ -0,0 +1,116 @@
+class ScriptedController:
+    """
+    Follow a scenario to run recording, training and autopilot cycles unattended
+    Same interface as JoystickController
+
+    A scenario is a list of steps, ex :
+    ```
+        scenario = [
+            {"frames": 2000, "autodrive": True},    # drive 2000 frames with the inputs device (manual mode)
+            {"frames": 2000, "rec": True},          # keep recording all the frames
+            {"press": "train"},                     # train on the recorded samples
+            {"press": "reset"},
+            {"frames": 2000, "start_car": True},    # autopilot during 2000 frames
+            {"press": "exit"},
+        ]
+    ```
+    Keys of a step :
+        frames : duration of the step (frames of the client, or ticks without client)
+        rec, autodrive, start_car : buttons held during the step
+        angle, throttle, brake : inputs during the step (default : inputs device, or 0)
+        press : "train", "reset", "profile" or "exit", button pressed once (the step lasts one tick)
+    The exit button is pressed at the end of the scenario.
+    """
+    def __init__(self, scenario, inputs = None, client = None):
+        """
+        :param scenario: list of steps
+        :param inputs: device giving angle/throttle/brake when the step does not (ex: ReplayController)
+        :param client: Client, durations are counted in frames (None : in ticks)
+        """
+        self.scenario = scenario
+        self.inputs = inputs
+        self.client = client
+
+        self.ticks = 0
+        self.step_index = 0
+        self.step_start = None
+        self.step = {}
+        self.pressed = None
+        self.finished = False
+
+    def position(self):
+        """
+        Number of frames (or ticks) since the beginning
+        """
+        if self.client is None:
+            return self.ticks
+        return self.client.frames.get_version()
+
+    def tick(self):
+        self.ticks += 1
+        if self.inputs is not None:
+            self.inputs.tick()
+        self.pressed = None
+        position = self.position()
+        while self.step_index < len(self.scenario):
+            step = self.scenario[self.step_index]
+            if self.step_start is None:
+                # first tick of the step
+                self.step_start = position
+                self.step = step
+                self.pressed = step.get("press")
+                return
+            if "press" in step or position - self.step_start >= step.get("frames", 0):
+                self.step_index += 1
+                self.step_start = None
+                continue
+            return
+        self.step = {}
+        self.finished = True
+
+    def stop(self):
+        if self.inputs is not None:
+            self.inputs.stop()
+
+    def get_input(self, name):
+        """
+        :param name: "angle", "throttle" or "brake"
+        """
+        if name in self.step:
+            return self.step[name]
+        if self.inputs is not None:
+            return getattr(self.inputs, "get_" + name + "_controller")()
+        return 0
+
+    ## Custome control to drive the car and more generaly controle the software ##
+    ## Same for all hardware class ##
+
+    def get_angle_controller(self):
+        return self.get_input("angle")
+
+    def get_throttle_controller(self):
+        return self.get_input("throttle")
+
+    def get_brake_controller(self):
+        return self.get_input("brake")
+
+    def get_rec_controller(self):
+        return self.step.get("rec", False)
+
+    def get_autodrive_controller(self):
+        return self.step.get("autodrive", False)
+
+    def get_reset_controller(self):
+        return self.pressed == "reset"
+
+    def get_train_controller(self):
+        return self.pressed == "train"
+
+    def get_exit_app_controller(self):
+        return self.pressed == "exit" or self.finished
+
+    def get_start_car(self):
+        return self.step.get("start_car", False)
+
+    def get_profile_controller(self):
+        return self.pressed == "profile"
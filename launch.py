@@ -8,8 +8,12 @@ Don't forget adapt lines with #XXX (CamConf, Transformer_input, Transformer_outp
 import os
 import sys
 
-os.environ['DISPLAY'] = ':1'
-os.environ['QT_DEBUG_PLUGINS'] = '1'
+# No camera preview (no OpenCV / X11 needed), for server runs
+HEADLESS = False
+
+if not HEADLESS:
+    os.environ['DISPLAY'] = ':1'
+    os.environ['QT_DEBUG_PLUGINS'] = '1'
 
 # On CPU !
 os.environ["CUDA_VISIBLE_DEVICES"]="-1"
@@ -23,7 +27,13 @@ from core.camconf import CamConf
 from hardware.joystick import JoystickController
 from controller import Controller
 from brain.brain import Brain
+#from brain.tflite import TFLiteBrain
+from brain.trainer import BackgroundTrainer
+from brain.shadow import ShadowPredictor
 from manager import DataManager
+from utils.latency import LatencyTracer
+from utils.stats import DrivingStats
+from utils.profiler import SessionProfiler
 
 # Car type(donkey | bare | car01), R, G, B, Name, Font size
 car_config = ("donkey", 255, 85, 0, "Ahhhhhhhhhhhh", 25)
@@ -35,17 +45,31 @@ data_manager = DataManager("/home/nigiva/git/lopilo-trainer/data/", input_label=
 data_manager.copy_model("/home/nigiva/git/lopilo-trainer/data/model/extern/DCDeepModelV4.0-reda-renault-speed_accel_gyro-batch1024-1620155768.1678748")
 #data_manager.load_extern_sample("/home/nigiva/git/lopilo-trainer/data/sample/extern/corentin_renault_20000_record_controller")
 brain = Brain(data_manager)
+# Drive from the TFLite export (int8 calibrated on a recording, see benchmark/tflite_report.py)
+#brain = TFLiteBrain(data_manager, quantization = "int8", sample_dir = "/home/nigiva/git/lopilo-trainer/data/sample/extern/corentin_renault_20000_record_controller")
+# Latency of each stage (receive -> control send) written in the log dir every 10s
+tracer = LatencyTracer(data_manager, interval = 10)
+# Train in a worker process while the current brain keeps driving
+# Fine-tune on the session mixed with a replay buffer of 2000 past samples (same round time whatever the common pot size)
+# Each training lasts at most 120s and stops when val_mse has not improved for 2 epochs (best weights kept)
+trainer = BackgroundTrainer(data_manager, brain, nbr_epoch = 20, replay_size = 2000, time_budget = 120, patience = 2)
+# Record the frames where the brain disagrees with the user (autodrive button) without slowing down the driving
+shadow = ShadowPredictor(brain, data_manager, batch_size = 8, max_queue = 64, threshold = 0.1)
 joystick = JoystickController(0)
 data_manager.next()
+# Laps, FPS and controls printed and written in the log dir every 10s
+stats = DrivingStats(interval = 10, path = data_manager.get_stats_path())
+# Profile the client and controller threads for 10s on : kill -USR1 <pid>, Square + Triangle, or touch <data_path>/PROFILE
+profiler = SessionProfiler(data_manager, duration = 10, mode = "sampling")
 
 
 # Competition : sim.diyrobocars.fr 9091
 # Gandalf : 192.168.103.37 9091
 # 35.204.119.122
 
-client = Client("192.168.103.37", 9091, convert_json2img = True)
+client = Client("192.168.103.37", 9091, convert_json2img = True, event_driven = True, tracer = tracer, profiler = profiler)
 client.send_scene("roboracingleague_1")
 #cc = CamConf(fov=100, fish_eye_x=0.1, fish_eye_y=0.0, img_w=160, img_h=120, img_d=3,
 #                    img_enc="JPEG", offset_x=0.0, offset_y=3.5, offset_z=2.0, rot_x=70.0) #XXX
 #client.set_cam_conf(cc)
-controller = Controller(client = client, hardware = joystick, data_manager = data_manager, brain = brain, autopilote = True, car_config = car_config)
+controller = Controller(client = client, hardware = joystick, data_manager = data_manager, brain = brain, autopilote = True, car_config = car_config, tracer = tracer, headless = HEADLESS, trainer = trainer, shadow = shadow, stats = stats, profiler = profiler)
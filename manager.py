@@ -1,5 +1,6 @@
 import os
 import shutil
+import random
 from utils.uid import UID
 from tqdm import tqdm
 import json
@@ -9,28 +10,36 @@ from io import BytesIO
 import pandas as pd
 import tensorflow as tf
 from time import time
+from threading import Lock
 from tensor_builder import DonkeyCarTensorBuilder
+from core.telemetry import write_raw_sample
 
 class DataManager:
     """
     Manage all data : model savefiles, log files and samples records
     """
-    def __init__(self, data_path, begin_id = 0, input_label = {'input':['path'], 'speed_accel_gyro':['speed', 'accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z']}, output_label = {'angle':['user_angle']}, num_parallel_calls = 3, image_shape = (120, 160, 3)):
-        self.uid = UID()
+    def __init__(self, data_path, begin_id = 0, input_label = {'input':['path'], 'speed_accel_gyro':['speed', 'accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z']}, output_label = {'angle':['user_angle']}, num_parallel_calls = 3, image_shape = (120, 160, 3), uid = None):
+        """
+        :param uid: uid of an existing session to open (its dirs are not created), None : new session
+        """
+        self.uid = UID() if uid is None else uid
         self.data_path = data_path
         self.id = begin_id
 
         self.model_path = os.path.join(self.data_path, "model", "model_" + self.uid)
-        os.mkdir(self.model_path)
         self.log_path = os.path.join(self.data_path, "log", "log_" + self.uid)
-        os.mkdir(self.log_path)
         self.sample_path = os.path.join(self.data_path, "sample", "sample_" + self.uid)
-        os.mkdir(self.sample_path)
+        if uid is None:
+            os.mkdir(self.model_path)
+            os.mkdir(self.log_path)
+            os.mkdir(self.sample_path)
 
         self.tensor_builder = DonkeyCarTensorBuilder(input_label = input_label, output_label = output_label, num_parallel_calls = num_parallel_calls, image_shape = image_shape)
 
         self.sample_base = None
         self.sample_file = None
+        # the samples can be appended from several threads (ex: ShadowPredictor)
+        self.sample_lock = Lock()
 
         self.last_time_save = time()
 
@@ -149,11 +158,10 @@ class DataManager:
             common_pot = open(self.get_common_pot(), "a")
             with open(csv_path, "r") as f:
                 for i, line in enumerate(tqdm(f)):
-                    if i == 0:
-                        if is_first_time:
-                            common_pot.write(line)#XXX
-                            continue
-                    common_pot.write(line)
+                    if i == 0 and not is_first_time:
+                        # the header is only written once
+                        continue
+                    common_pot.write(line)#XXX
             common_pot.close()
 
     def get_common_pot(self):
@@ -162,12 +170,101 @@ class DataManager:
         """
         return os.path.join(self.sample_path, "common_pot.csv")
 
+    def get_replay_buffer(self):
+        """
+        Get path of the replay buffer file containing a bounded random subset of all the samples (see add_to_replay_buffer)
+        """
+        return os.path.join(self.sample_path, "replay_buffer.csv")
+
+    def get_sample_columns(self):
+        """
+        Columns of the label.csv used by the tensor builder
+        """
+        columns = []
+        for labels in list(self.tensor_builder.input_label.values()) + list(self.tensor_builder.output_label.values()):
+            columns += [label for label in labels if label not in columns]
+        return columns
+
+    def read_samples(self, csv_path):
+        """
+        Read the columns used by the tensor builder of a label.csv (0 if a column is missing)
+        """
+        df = pd.read_csv(csv_path)
+        for column in self.get_sample_columns():
+            if column not in df.columns:
+                df[column] = 0
+        return df[self.get_sample_columns()]
+
+    def load_replay_buffer(self):
+        """
+        Read the replay buffer, made from the base samples if it does not exist yet
+        :return: (DataFrame of the buffer, number of samples seen by the buffer)
+        """
+        path = self.get_replay_buffer()
+        if os.path.exists(path):
+            with open(path + ".json", "r") as f:
+                seen = json.load(f)["seen"]
+            return pd.read_csv(path), seen
+        empty = pd.DataFrame(columns=self.get_sample_columns())
+        if self.sample_base is not None and os.path.exists(os.path.join(self.sample_base, "label.csv")):
+            return self.reservoir(empty, 0, self.read_samples(os.path.join(self.sample_base, "label.csv")))
+        return empty, 0
+
+    def reservoir(self, buffer, seen, samples, replay_size = 2000, seed = None):
+        """
+        Reservoir sampling : after the merge, each sample seen has the same probability
+        to be in the buffer, and the buffer keeps at most replay_size samples
+        :return: (DataFrame of the buffer, number of samples seen by the buffer)
+        """
+        rng = random.Random(seed)
+        rows = buffer.to_dict("records")
+        for row in samples.to_dict("records"):
+            if len(rows) < replay_size:
+                rows.append(row)
+            else:
+                i = rng.randrange(seen + 1)
+                if i < replay_size:
+                    rows[i] = row
+            seen += 1
+        return pd.DataFrame(rows, columns=self.get_sample_columns()), seen
+
+    def add_to_replay_buffer(self, replay_size = 2000, seed = None):
+        """
+        Merge the samples of label.csv into the replay buffer (cost independent of the number of past samples)
+        :param replay_size: maximum number of samples in the buffer
+        """
+        csv_path = os.path.join(self.get_dir("sample"), "label.csv")
+        if os.path.exists(csv_path):
+            buffer, seen = self.load_replay_buffer()
+            buffer, seen = self.reservoir(buffer, seen, self.read_samples(csv_path), replay_size = replay_size, seed = seed)
+            buffer.to_csv(self.get_replay_buffer(), index=False)
+            with open(self.get_replay_buffer() + ".json", "w") as f:
+                json.dump({"seen" : seen, "size" : len(buffer)}, f)
+
     def get_log_path(self):
         """
         Get log path
         """
         return os.path.join(self.get_dir("log"), "log.json")
 
+    def get_latency_path(self):
+        """
+        Get latency summary path
+        """
+        return os.path.join(self.get_dir("log"), "latency.json")
+
+    def get_stats_path(self):
+        """
+        Get driving stats path (json lines)
+        """
+        return os.path.join(self.get_dir("log"), "stats.jsonl")
+
+    def get_cache_dir(self):
+        """
+        Get the forward cache dir, shared by all the sessions (see brain.cache)
+        """
+        return os.path.join(self.data_path, "model", "cache")
+
     def get_sample_path(self):
         """
         Get sample path
@@ -196,15 +293,21 @@ class DataManager:
         if not os.path.exists(path):
             os.mkdir(path)
     
-    def set_log(self, history):
+    def set_log(self, history, summary = None):
 
         """
         Create a log file and add history in json file
         :param history: history (dict) given by fit function (keras)
+        :param summary: dict added under the "training" key (ex: stop reason and samples/sec, see brain.callbacks)
         """     
         df = pd.DataFrame(history.history) 
         with open(self.get_log_path(), 'w') as f:
-            df.to_json(f)
+            if summary is None:
+                df.to_json(f)
+            else:
+                log = json.loads(df.to_json())
+                log["training"] = summary
+                json.dump(log, f)
     
     def next(self):
         """
@@ -215,10 +318,11 @@ class DataManager:
         os.mkdir(self.get_dir("log"))
         os.mkdir(self.get_dir("sample"))
 
-        if self.sample_file is not None:
-            self.sample_file.close()
-            self.sample_count = 0
-        self.sample_file = open(os.path.join(self.get_dir("sample"), "sample.eslr"), "w")
+        with self.sample_lock:
+            if self.sample_file is not None:
+                self.sample_file.close()
+                self.sample_count = 0
+            self.sample_file = open(os.path.join(self.get_dir("sample"), "sample.eslr"), "wb")
     
     def append_sample(self, json, delay = 1/50, debug = False):
         """
@@ -227,18 +331,40 @@ class DataManager:
         :param sleep: delay between two record
         """
         t = time()
-        if self.sample_file is not None and t - self.last_time_save > delay:
-            self.sample_file.write(json + "\n")
-            self.sample_count += 1
-            self.last_time_save = t
-            if debug:
-                print(self.sample_count)
+        with self.sample_lock:
+            if self.sample_file is not None and t - self.last_time_save > delay:
+                self.sample_file.write((json + "\n").encode("utf-8"))
+                self.sample_count += 1
+                self.last_time_save = t
+                if debug:
+                    print(self.sample_count)
+
+    def append_raw_sample(self, raw, user_angle, user_throttle, user_brake, delay = 1/50, debug = False, t = None):
+        """
+        Append the telemetry as received from the simulator to the json file (.eslr),
+        only the user fields are added (no json decoding/encoding of the message)
+        :param raw: json bytes of the telemetry message (Client.get_telemetry)
+        :param delay: delay between two record
+        :param t: time of the frame (default : now), used for the delay
+        """
+        if t is None:
+            t = time()
+        with self.sample_lock:
+            if self.sample_file is not None and raw is not None and t - self.last_time_save > delay:
+                if not write_raw_sample(self.sample_file, raw, user_angle, user_throttle, user_brake):
+                    print("[WARNING] Sample not recorded : non-finite control", (user_angle, user_throttle, user_brake))
+                    return
+                self.sample_count += 1
+                self.last_time_save = t
+                if debug:
+                    print(self.sample_count)
 
     def close(self):
-        if self.sample_file is not None:
-            self.sample_file.close()
-            self.sample_file = None
-            self.sample_count = 0
+        with self.sample_lock:
+            if self.sample_file is not None:
+                self.sample_file.close()
+                self.sample_file = None
+                self.sample_count = 0
 
     def make_dataset(self, nbr_base_sample = 500, nbr_common_pot = 500, nbr_current_sample = 1000, batch_size = 64, test_ratio = 0.1):
         """
@@ -295,4 +421,37 @@ class DataManager:
 
         train_dataset = train_base_sample_tensor.concatenate(train_common_pot_tensor).concatenate(train_current_sample_tensor)
         train_dataset = train_dataset.batch(batch_size).prefetch(2)
+        return train_dataset, test_dataset
+
+    def make_incremental_dataset(self, replay_size = 2000, nbr_current_sample = 2000, batch_size = 64, test_ratio = 0.1, seed = None):
+        """
+        Make dataset in self.id - 1 (file is close) directory for a fine-tuning :
+        the samples of the session mixed with the replay buffer of the past sessions (see add_to_replay_buffer),
+        so the size of the dataset does not grow with the common pot
+
+        :param replay_size: maximum number of samples of the replay buffer
+        :param nbr_current_sample: maximum number of samples selected randomly in self.id - 1 dir
+        """
+        self.load_sample()
+        current_sample_pd = self.read_samples(os.path.join(self.sample_path, str(self.id), "label.csv"))
+        current_sample_pd = current_sample_pd.sample(frac=1, random_state=seed).head(nbr_current_sample)
+        replay_pd, _ = self.load_replay_buffer()
+        replay_pd = replay_pd.sample(frac=1, random_state=seed).head(replay_size)
+
+        # the test samples are taken from both, and are not in the train samples
+        nbr_test_current = int(len(current_sample_pd) * test_ratio)
+        nbr_test_replay = int(len(replay_pd) * test_ratio)
+        if len(replay_pd) == 0:
+            # first session without base samples (an empty frame would change the dtypes)
+            replay_pd = current_sample_pd.head(0)
+        test_pd = pd.concat([current_sample_pd.head(nbr_test_current), replay_pd.head(nbr_test_replay)])
+        train_pd = pd.concat([current_sample_pd.iloc[nbr_test_current:], replay_pd.iloc[nbr_test_replay:]])
+        print("[INFO] Incremental dataset :", len(current_sample_pd), "current samples /", len(replay_pd), "replay samples")
+
+        test_dataset = self.tensor_builder.normalize_dataset(self.tensor_builder.load_image(self.tensor_builder.dataset_to_tensor(test_pd)))
+        test_dataset = test_dataset.batch(batch_size).prefetch(2)
+
+        train_dataset = self.tensor_builder.dataset_to_tensor(train_pd).shuffle(len(train_pd))
+        train_dataset = self.tensor_builder.normalize_dataset(self.tensor_builder.load_image(train_dataset))
+        train_dataset = train_dataset.batch(batch_size).prefetch(2)
         return train_dataset, test_dataset
\ No newline at end of file
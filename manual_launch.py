@@ -31,7 +31,7 @@ brain = None
 joystick = JoystickController(0)
 data_manager.next()
 
-client = Client("127.0.0.1", 9091, convert_json2img = True)
+client = Client("127.0.0.1", 9091, convert_json2img = True, event_driven = True)
 #cc = CamConf(fov=100, fish_eye_x=0.1, fish_eye_y=0.0, img_w=160, img_h=120, img_d=3,
 #                    img_enc="JPEG", offset_x=0.0, offset_y=3.5, offset_z=2.0, rot_x=70.0) #XXX
 #client.set_cam_conf(cc)
@@ -0,0 +1,48 @@
+"""
+Unattended Lopilo Trainer
+Run recording, training and autopilot cycles from a scenario, without joystick
+
+Don't forget adapt lines with #XXX (CamConf, Transformer_input, Transformer_output, ...)
+"""
+
+import os
+import sys
+
+# On CPU !
+os.environ["CUDA_VISIBLE_DEVICES"]="-1"
+# For avoid warning in Visual Code
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from core.client import Client
+from hardware.replay import ReplayController
+from hardware.scripted import ScriptedController
+from controller import Controller
+from brain.brain import Brain
+from manager import DataManager
+
+input_label = {'input':['path'], 'speed_accel_gyro':['speed', 'accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z']}
+output_label = {'angle':['user_angle']}
+
+data_manager = DataManager("/home/nigiva/git/lopilo-trainer/data/", input_label=input_label, output_label=output_label)
+data_manager.copy_model("/home/nigiva/git/lopilo-trainer/data/model/extern/DCDeepModelV4.0-reda-renault-speed_accel_gyro-batch1024-1620155768.1678748")
+brain = Brain(data_manager)
+data_manager.next()
+
+client = Client("127.0.0.1", 9091, convert_json2img = True, event_driven = True)
+client.send_scene("roboracingleague_1")
+
+# Inputs of the human driver replayed from a recording #XXX
+inputs = ReplayController("/home/nigiva/git/lopilo-trainer/data/sample/extern/corentin_renault_20000_record_controller.eslr", client = client, loop = True)
+scenario = [
+    # drive with the replayed inputs, record the frames where the brain disagrees
+    {"frames": 2000, "autodrive": True},
+    {"press": "train"},
+    {"press": "reset"},
+    {"frames": 2000, "start_car": True},
+    {"press": "reset"},
+    {"press": "exit"},
+]
+hardware = ScriptedController(scenario, inputs = inputs, client = client)
+controller = Controller(client = client, hardware = hardware, data_manager = data_manager, brain = brain, autopilote = True, headless = True)
@@ -0,0 +1,73 @@
+import os
+from threading import Thread, Condition
+from time import time
+
+class Display:
+    """
+    Preview of the camera in its own thread
+    Only the latest frame is shown, at most refresh_rate times per second,
+    so the control loop is never blocked by OpenCV
+    """
+    def __init__(self, window_name = "view", refresh_rate = 20):
+        """
+        :param window_name: name of the OpenCV window
+        :param refresh_rate: maximum number of frames shown per second
+        """
+        # OpenCV is only needed when the preview is used (not in headless mode)
+        if os.environ.get('DISPLAY', '') == '':
+            os.environ['DISPLAY'] = ':1'
+        import cv2
+        self.cv2 = cv2
+
+        self.window_name = window_name
+        self.period = 1.0 / refresh_rate
+        self.cond = Condition()
+        self.img = None
+        self.running = True
+        # frames given to show() but replaced before being displayed
+        self.dropped = 0
+
+        self.th = Thread(target=self.loop, daemon=True)
+        self.th.start()
+
+    def show(self, img):
+        """
+        Give the latest frame to display (never blocks)
+        :param img: RGB numpy array (not modified)
+        """
+        with self.cond:
+            if self.img is not None:
+                self.dropped += 1
+            self.img = img
+            self.cond.notify()
+
+    def loop(self):
+        cv2 = self.cv2
+        last_time = 0
+        while self.running:
+            with self.cond:
+                while self.running and self.img is None:
+                    self.cond.wait()
+                img = self.img
+                self.img = None
+            if img is None:
+                break
+            cv2.imshow(self.window_name, cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            cv2.waitKey(1)
+            # cap the refresh rate
+            delay = last_time + self.period - time()
+            if delay > 0:
+                with self.cond:
+                    self.cond.wait_for(lambda: not self.running, delay)
+            last_time = time()
+        try:
+            cv2.destroyWindow(self.window_name)
+        except cv2.error:
+            # the window has never been created
+            pass
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.th.join()
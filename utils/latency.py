@@ -0,0 +1,114 @@
+import os
+import json
+import numpy as np
+from collections import deque, OrderedDict
+from threading import Thread, Lock, Event
+from time import perf_counter
+
+# Stages of a telemetry frame, in order
+STAGES = ("recv", "parse", "decode", "inference_start", "inference_end", "send")
+
+class LatencyTracer:
+    """
+    Stamp each telemetry frame (identified by its version) at each stage,
+    from the socket receive to the control send, and aggregate the latency
+    of each stage (time since the previous stamped stage) and the total latency
+    """
+    def __init__(self, data_manager = None, interval = None, history = 10000, max_pending = 64):
+        """
+        :param data_manager: DataManager, the summary is written in its log dir
+        :param interval: write the summary every interval seconds (None : only on demand)
+        :param history: number of latencies kept by stage
+        :param max_pending: number of frames not sent kept before being dropped
+        """
+        self.data_manager = data_manager
+        self.lock = Lock()
+        self.pending = OrderedDict()
+        self.max_pending = max_pending
+        self.latencies = {stage: deque(maxlen=history) for stage in STAGES[1:] + ("total",)}
+        self.dropped = 0
+
+        self.stop_event = Event()
+        self.th = None
+        if interval is not None:
+            self.th = Thread(target=self.write_loop, args=(interval,), daemon=True)
+            self.th.start()
+
+    def begin(self, version, t_recv, t_parse):
+        """
+        Stamp the receive and parse time of a new frame
+        """
+        with self.lock:
+            self.pending[version] = {"recv": t_recv, "parse": t_parse}
+            if len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+
+    def stamp(self, version, stage):
+        """
+        Stamp a stage of a frame now
+        :param stage: "decode", "inference_start", "inference_end" or "send"
+        """
+        t = perf_counter()
+        with self.lock:
+            stamps = self.pending.get(version)
+            if stamps is None or stage in stamps:
+                return
+            stamps[stage] = t
+            if stage == "send":
+                del self.pending[version]
+                self.aggregate(stamps)
+
+    def aggregate(self, stamps):
+        """
+        Add the latencies of a finished frame (lock held)
+        """
+        last = stamps["recv"]
+        for stage in STAGES[1:]:
+            t = stamps.get(stage)
+            if t is not None:
+                self.latencies[stage].append(t - last)
+                last = t
+        self.latencies["total"].append(last - stamps["recv"])
+
+    def summary(self):
+        """
+        :return: dict stage -> {"count", "mean", "p50", "p95", "p99"} in ms
+        """
+        with self.lock:
+            latencies = {stage: np.array(values) * 1000 for stage, values in self.latencies.items()}
+        summary = {}
+        for stage, values in latencies.items():
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[stage] = {"count": len(values), "mean": float(values.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        return summary
+
+    def print_summary(self):
+        for stage, s in self.summary().items():
+            print("[INFO]", stage.ljust(16), "n =", s["count"], "/ p50 =", round(s["p50"], 2), "ms / p95 =", round(s["p95"], 2), "ms / p99 =", round(s["p99"], 2), "ms")
+
+    def dump(self, path = None):
+        """
+        Write the summary as json
+        :param path: file path (default : latency.json in the log dir of the data manager)
+        """
+        if path is None:
+            if self.data_manager is None:
+                return
+            path = self.data_manager.get_latency_path()
+        if not os.path.exists(os.path.dirname(path)):
+            return
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_loop(self, interval):
+        while not self.stop_event.wait(interval):
+            self.dump()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.th is not None:
+            self.th.join()
+        self.dump()
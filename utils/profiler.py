@@ -0,0 +1,210 @@
+"""
+On-demand profiling of a live session
+
+The profiling is started without restarting the session, by :
+    - a signal (default SIGUSR1) : kill -USR1 <pid>
+    - the joystick (see get_profile_controller of the hardware)
+    - a flag file : touch <data_path>/PROFILE (its content can give the duration in seconds)
+and captures the Client and Controller threads during duration seconds.
+
+Two modes :
+    - "sampling" : a thread samples the stacks of the threads (sys._current_frames),
+                   nothing is changed in the profiled threads
+    - "cprofile" : each thread runs cProfile between two checkpoint() calls of its loop
+
+The result is written in the current log dir (DataManager.get_dir("log")) :
+profile_<time>.prof (cprofile, for pstats/snakeviz) or profile_<time>.folded
+(sampling, for flamegraph.pl/speedscope) and profile_<time>.txt (summary by function).
+While it is off, the cost is one attribute check by checkpoint().
+"""
+import os
+import io
+import sys
+import signal
+import cProfile
+import pstats
+import threading
+from collections import Counter
+from time import time, sleep, strftime
+
+class SessionProfiler:
+    def __init__(self, data_manager, duration = 10, mode = "sampling", threads = ("client", "controller"), interval = 0.005,
+                 signum = signal.SIGUSR1, flag_path = None, flag_interval = 1, top = 40):
+        """
+        :param data_manager: DataManager, the results are written in its current log dir
+        :param duration: default capture duration (seconds)
+        :param mode: "sampling" or "cprofile"
+        :param threads: names of the threads profiled (None : all the threads)
+        :param interval: sampling period (seconds)
+        :param signum: signal starting a capture (None : no signal), installed only from the main thread
+        :param flag_path: file starting a capture when it exists, it is removed (default : <data_path>/PROFILE, None : no flag)
+        :param flag_interval: period of the check of the flag file (seconds)
+        :param top: number of functions in the summary
+        """
+        if mode not in ("sampling", "cprofile"):
+            raise Exception("Unknown profiling mode : " + str(mode))
+        self.data_manager = data_manager
+        self.duration = duration
+        self.mode = mode
+        self.threads = None if threads is None else frozenset(threads)
+        self.interval = interval
+        self.top = top
+        self.lock = threading.Lock()
+
+        # set while a capture is running (read by checkpoint() without lock)
+        self.active = False
+        self.deadline = 0
+        # cprofile mode : thread name -> Profile
+        self.profiles = {}
+        self.finished_threads = set()
+        self.last_result = None
+
+        if signum is not None and threading.current_thread() is threading.main_thread():
+            signal.signal(signum, lambda signum, frame: self.trigger())
+
+        self.running = True
+        self.flag_path = os.path.join(data_manager.data_path, "PROFILE") if flag_path is None else flag_path
+        self.flag_interval = flag_interval
+        self.th_flag = threading.Thread(target=self.flag_loop, name="profiler-flag", daemon=True)
+        self.th_flag.start()
+
+    def flag_loop(self):
+        while self.running:
+            if os.path.exists(self.flag_path):
+                duration = None
+                try:
+                    with open(self.flag_path, "r") as f:
+                        content = f.read().strip()
+                    if content != "":
+                        duration = float(content)
+                    os.remove(self.flag_path)
+                except (OSError, ValueError) as e:
+                    print("[WARNING] Profiler flag :", e)
+                self.trigger(duration)
+            sleep(self.flag_interval)
+
+    def trigger(self, duration = None):
+        """
+        Start a capture (ignored if one is running)
+        :param duration: capture duration (None : default duration)
+        :return: True if the capture has been started
+        """
+        with self.lock:
+            if self.active:
+                return False
+            duration = self.duration if duration is None else duration
+            self.deadline = time() + duration
+            self.profiles = {}
+            self.finished_threads = set()
+            self.active = True
+        print("[INFO] Profiling (" + self.mode + ") for", duration, "s")
+        target = self.sample if self.mode == "sampling" else self.wait_profiles
+        threading.Thread(target=target, args=(duration,), name="profiler", daemon=True).start()
+        return True
+
+    def checkpoint(self):
+        """
+        Called on each iteration of the loops of the profiled threads (cprofile mode)
+        """
+        if not self.active or self.mode != "cprofile":
+            return
+        name = threading.current_thread().name
+        if self.threads is not None and name not in self.threads:
+            return
+        profile = self.profiles.get(name)
+        if time() < self.deadline:
+            if profile is None and name not in self.finished_threads:
+                profile = cProfile.Profile()
+                self.profiles[name] = profile
+                profile.enable()
+        elif profile is not None and name not in self.finished_threads:
+            # a profile is disabled by its own thread
+            profile.disable()
+            self.finished_threads.add(name)
+
+    def wait_profiles(self, duration):
+        """
+        cprofile mode : wait for the end of the capture in all the threads then write the result
+        """
+        sleep(duration)
+        # the threads disable their profile at their next checkpoint
+        grace = time() + 2
+        while time() < grace and len(self.finished_threads) < len(self.profiles):
+            sleep(0.05)
+        profiles = [p for name, p in self.profiles.items() if name in self.finished_threads]
+        if len(profiles) == 0:
+            print("[WARNING] Profiling : no thread has reached a checkpoint")
+        else:
+            self.write_cprofile(profiles)
+        self.active = False
+
+    def write_cprofile(self, profiles):
+        base = self.result_base()
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(base + ".prof")
+        summary = io.StringIO()
+        summary.write("threads : " + ", ".join(sorted(self.finished_threads)) + "\n")
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        self.write_summary(base, summary.getvalue(), base + ".prof")
+
+    def sample(self, duration):
+        """
+        sampling mode : sample the stacks of the threads until the deadline then write the result
+        """
+        own = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        leaves = Counter()
+        cumulative = Counter()
+        nbr_sample = 0
+        while time() < self.deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == own or (self.threads is not None and name not in self.threads):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + ")")
+                    frame = frame.f_back
+                stack.reverse()
+                stacks[name + ";" + ";".join(stack)] += 1
+                leaves[stack[-1]] += 1
+                for function in set(stack):
+                    cumulative[function] += 1
+            nbr_sample += 1
+            sleep(self.interval)
+        base = self.result_base()
+        with open(base + ".folded", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(stack.replace(" ", "_") + " " + str(count) + "\n")
+        summary = io.StringIO()
+        summary.write(str(nbr_sample) + " samples every " + str(self.interval * 1000) + " ms\n\n")
+        total = max(1, sum(leaves.values()))
+        summary.write("self (function on top of the stack) :\n")
+        for function, count in leaves.most_common(self.top):
+            summary.write("%6.2f%%  %s\n" % (100 * count / total, function))
+        summary.write("\ncumulative (function in the stack) :\n")
+        for function, count in cumulative.most_common(self.top):
+            summary.write("%6.2f%%  %s\n" % (100 * count / total, function))
+        self.write_summary(base, summary.getvalue(), base + ".folded")
+        self.active = False
+
+    def result_base(self):
+        return os.path.join(self.data_manager.get_dir("log"), "profile_" + strftime("%Y%m%d-%H%M%S"))
+
+    def write_summary(self, base, summary, result_path):
+        with open(base + ".txt", "w") as f:
+            f.write(summary)
+        self.last_result = result_path
+        print("[INFO] Profiling written :", result_path, "/ summary :", base + ".txt")
+
+    def stop(self):
+        self.running = False
+        self.th_flag.join()
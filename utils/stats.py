@@ -0,0 +1,168 @@
+import json
+import socket
+from collections import deque
+from threading import Thread, Event
+from time import time
+
+class DrivingStats:
+    """
+    Driving statistics of the control loop (laps, active node, lap times, FPS, controls)
+
+    The control loop only updates counters and ring buffers (no I/O),
+    a summary is emitted every interval seconds by a thread :
+    printed, appended as a json line to a file and/or sent as a UDP datagram
+    """
+    def __init__(self, interval = 10, history = 1000, path = None, address = None, verbose = True):
+        """
+        :param interval: seconds between two summaries
+        :param history: number of values kept in the ring buffers
+        :param path: json lines file where the summaries are appended (None : no file)
+        :param address: (host, port) where the summaries are sent by UDP (None : no socket)
+        :param verbose: print the summaries
+        """
+        self.interval = interval
+        self.path = path
+        self.address = address
+        self.verbose = verbose
+
+        self.nodes = deque(maxlen=history)
+        self.lap_times = deque(maxlen=history)
+        self.controls = deque(maxlen=history)
+        self.frames = 0
+        self.last_frames = 0
+        self.last_summary_time = time()
+        # other values added to the summary, name -> function returning a dict
+        self.sources = {}
+        self.reset_laps()
+
+        self.file = open(path, "a") if path is not None else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if address is not None else None
+
+        self.stop_event = Event()
+        self.th = Thread(target=self.emit_loop, daemon=True)
+        self.th.start()
+
+    def reset_laps(self):
+        """
+        Restart the lap counting (ex: after a reset of the car)
+        """
+        self.is_passed_once = False
+        self.last_node = 0
+        self.number_turn = -1
+        self.time_ref = None
+        self.time_last_turn = 0
+        self.lap_start = None
+
+    def add_source(self, name, source):
+        """
+        Add values to the summaries
+        :param source: function returning a dict, called by the thread of the summaries
+        """
+        self.sources[name] = source
+
+    def update(self, telemetry):
+        """
+        Count the turns with the active node of a new telemetry frame
+        """
+        current_node = telemetry.activeNode
+        current_time = telemetry.time
+        self.nodes.append(current_node)
+        if self.last_node > 110 and current_node < 3 and not self.is_passed_once:
+            self.number_turn += 1
+            if self.number_turn == 0:
+                self.time_ref = current_time
+            else:
+                self.lap_times.append(current_time - self.lap_start)
+            self.lap_start = current_time
+            self.is_passed_once = True
+            self.time_last_turn = current_time - self.time_ref
+            if self.verbose:
+                # once per lap
+                print("[INFO]", "turn =", self.number_turn, "/ Cumulative time since last turn =", self.time_last_turn)
+        if current_node > 3:
+            self.is_passed_once = False
+        self.last_node = current_node
+
+    def frame(self):
+        """
+        Count a processed frame (FPS)
+        """
+        self.frames += 1
+
+    def control(self, angle, throttle, brake):
+        """
+        Record a control sent to the car
+        """
+        self.controls.append((angle, throttle, brake))
+
+    def summary(self):
+        """
+        :return: dict of the statistics since the previous summary
+        """
+        t = time()
+        frames = self.frames
+        delta = t - self.last_summary_time
+        fps = (frames - self.last_frames) / delta if delta > 0 else 0
+        self.last_frames = frames
+        self.last_summary_time = t
+
+        controls = list(self.controls)
+        lap_times = list(self.lap_times)
+        summary = {
+            "time" : t,
+            "fps" : fps,
+            "turn" : self.number_turn,
+            "active_node" : self.last_node,
+            "cumulative_time" : self.time_last_turn,
+            "last_lap" : lap_times[-1] if len(lap_times) > 0 else None,
+            "best_lap" : min(lap_times) if len(lap_times) > 0 else None,
+        }
+        if len(controls) > 0:
+            angles = [c[0] for c in controls]
+            summary["control"] = {
+                "last" : [float(v) for v in controls[-1]],
+                "angle_mean" : float(sum(angles) / len(angles)),
+                "angle_min" : float(min(angles)),
+                "angle_max" : float(max(angles)),
+                "throttle_mean" : float(sum(c[1] for c in controls) / len(controls)),
+            }
+        for name, source in self.sources.items():
+            summary[name] = source()
+        return summary
+
+    def emit(self):
+        summary = self.summary()
+        if self.verbose:
+            print("[INFO]", "FPS = %.1f" % summary["fps"], "/ turn =", summary["turn"], "/ activeNode =", summary["active_node"],
+                  "/ Cumulative time since last turn =", summary["cumulative_time"], "/ last lap =", summary["last_lap"], "/ best lap =", summary["best_lap"])
+            if "control" in summary:
+                print("[INFO]", "control :", summary["control"])
+            for name in self.sources:
+                print("[INFO]", name, ":", summary[name])
+        line = json.dumps(summary)
+        if self.file is not None:
+            self.file.write(line + "\n")
+            self.file.flush()
+        if self.sock is not None:
+            try:
+                self.sock.sendto(line.encode("utf-8"), self.address)
+            except OSError as e:
+                print("[WARNING] Stats not sent :", e)
+
+    def emit_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.emit()
+            except Exception as e:
+                print("[ERROR] Stats :", e)
+
+    def stop(self):
+        self.stop_event.set()
+        self.th.join()
+        self.emit()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None